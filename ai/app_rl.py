@@ -5,19 +5,41 @@
 # PDFs, recognizing the limitations of forensic analysis on converted files.
 # -----------------------------------------------------------------------------
 
-from flask import Flask, request, jsonify
+from flask import Flask, Request, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-from werkzeug.utils import secure_filename
-import cv2
 import numpy as np
 import os
+import io
+import tempfile
+import json
 import hashlib
+import hmac
+import time
+import threading
+import zipfile
+import zlib
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 from dotenv import load_dotenv
-from PIL import Image
-import pickle
 import pytesseract
-import piexif
-from pdf2image import convert_from_path
+
+# numpy, OpenCV, PIL and pytesseract are needed by every request, so they are
+# imported here on purpose: under gunicorn.conf.py the master imports app_rl
+# once (preload_app, then gc.freeze) and the workers share those pages. What a
+# request may never need is imported where it is used: pdf2image (PDFs only),
+# tesserocr (the OCR engine pool) and scikit-learn (the pickle fallback).
+# Load .env before the feature module reads its PRAMAAN_* settings.
+load_dotenv()
+from pramaan_features import ImageTooLargeError, anomaly_summary, extract_metrics, load_image, metrics_to_vector
+from pramaan_model import COMPILED_MODEL_PATH, MODEL_PATH, load_model
+from verdict_cache import VerdictCache
+from job_queue import JobQueue, QueueFullError
+from feedback_log import FeedbackLog, parse_label
+from phash_index import TemplateIndex
+from service_metrics import MetricsRegistry, SamplingProfiler, format_timing_header
+from ocr_gate import FOUND_MESSAGE, NOT_FOUND_MESSAGE, CertificateGate, OCRError, has_certificate_keywords
+import pdf_pages
 
 # --- Configuration ---
 # On Windows, you MUST provide the full path to your Poppler bin directory.
@@ -26,206 +48,740 @@ from pdf2image import convert_from_path
 poppler_path = r"C:\poppler-25.07.0\Library\bin"
 
 # If Tesseract is not in your system PATH, you must also set this path.
-pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+if os.path.isfile(tesseract_cmd):
+    pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
 
-load_dotenv()
+# -----------------------------------------------------------------------------
+# In-Memory Uploads
+# -----------------------------------------------------------------------------
+class HashingBuffer(io.BytesIO):
+    """In-memory file container that SHA-256 hashes the upload while it is being received."""
+    def __init__(self):
+        super().__init__()
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data) -> int:
+        self.sha256.update(data)
+        return super().write(data)
+
+class PramaanRequest(Request):
+    """Keeps uploaded files in a HashingBuffer instead of Werkzeug's spooled temp files."""
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingBuffer()
 
 app = Flask(__name__)
+app.request_class = PramaanRequest
 CORS(app)
 
-UPLOAD_DIR = os.path.join(os.getcwd(), 'ai_uploads')
-MODEL_PATH = 'pramaan_model.pkl'
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+# PDFs are the only uploads that touch a disk, because poppler reads files.
+# They are spilled to tmpfs when the system has one.
+SPILL_DIR = os.environ.get('PRAMAAN_SPILL_DIR') or ('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir())
+# Uploads larger than this are refused with 413 before they reach the disk.
+# A batch request may carry up to MAX_BATCH_BYTES, but each file in it is
+# still held to MAX_UPLOAD_BYTES.
+MAX_UPLOAD_BYTES = int(os.environ.get('PRAMAAN_MAX_UPLOAD_MB', '25')) * 1024 * 1024
+MAX_BATCH_BYTES = int(os.environ.get('PRAMAAN_MAX_BATCH_MB', '512')) * 1024 * 1024
+app.config['MAX_CONTENT_LENGTH'] = max(MAX_UPLOAD_BYTES, MAX_BATCH_BYTES)
+
+# Documents of a /ai/check/batch request are screened concurrently on this pool
+# (OpenCV and Tesseract release the GIL).
+BATCH_MAX_ITEMS = int(os.environ.get('PRAMAAN_BATCH_MAX_ITEMS', '500'))
+batch_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('PRAMAAN_BATCH_WORKERS', os.cpu_count() or 4)))
+
+# Tiered OCR gate. PRAMAAN_OCR_ENGINES persistent Tesseract engines are used
+# when the optional tesserocr package is installed.
+certificate_gate = CertificateGate(
+    cache_size=int(os.environ.get('PRAMAAN_OCR_CACHE_SIZE', '4096')),
+    pool_size=int(os.environ.get('PRAMAAN_OCR_ENGINES', '4')),
+)
+
+# Verdicts are cached by (upload SHA-256, model version). Set
+# PRAMAAN_VERDICT_CACHE_DB to a file path to persist them across restarts.
+verdict_cache = VerdictCache(
+    max_entries=int(os.environ.get('PRAMAAN_VERDICT_CACHE_SIZE', '4096')),
+    ttl_seconds=float(os.environ.get('PRAMAAN_VERDICT_CACHE_TTL', '86400')),
+    db_path=os.environ.get('PRAMAAN_VERDICT_CACHE_DB') or None,
+)
+
+# Stage latencies and counters for /ai/metrics. X-Pramaan-Timing is added to
+# /ai/check responses when PRAMAAN_TIMING_HEADER=1 or the request sends it.
+# With PRAMAAN_PROFILING=1, a request sending 'X-Pramaan-Profile: 1' is
+# sampled and its collapsed stacks are written to PRAMAAN_PROFILE_DIR.
+service_metrics = MetricsRegistry(window=int(os.environ.get('PRAMAAN_METRICS_WINDOW', '1024')))
+TIMING_HEADER = os.environ.get('PRAMAAN_TIMING_HEADER', '0') == '1'
+PROFILING_ENABLED = os.environ.get('PRAMAAN_PROFILING', '0') == '1'
+PROFILE_DIR = os.environ.get('PRAMAAN_PROFILE_DIR') or os.path.join(tempfile.gettempdir(), 'pramaan-profiles')
 
 # -----------------------------------------------------------------------------
 # Load the Trained Model and Scaler
 # -----------------------------------------------------------------------------
+# pramaan_model.npz (compiled, no pickle) is preferred; the pickle is the fallback.
+# The files are checked every PRAMAAN_MODEL_RELOAD_SECONDS (0 disables this)
+# and a retrained model is swapped in without a restart (see reload_model).
+MODEL_RELOAD_SECONDS = float(os.environ.get('PRAMAAN_MODEL_RELOAD_SECONDS', '5'))
+
+def model_files_stamp() -> tuple:
+    """(size, mtime_ns) of each model file, or None if missing; the trainer changes it by renaming new files in."""
+    stamp = []
+    for path in (COMPILED_MODEL_PATH, MODEL_PATH):
+        try:
+            st = os.stat(path)
+            stamp.append((st.st_size, st.st_mtime_ns))
+        except FileNotFoundError:
+            stamp.append(None)
+    return tuple(stamp)
+
+# No model is shipped with the repository: it is trained from the dataset
+# for the current feature schema. Until then /ai/check and /ai/health/ready
+# answer 503 with model_error as the reason.
+RETRAIN_HINT = 'Train one with: cd ai && python train_rl_model.py'
+
+model = model_version = None
+model_error = None
+model_stamp = model_files_stamp()
 try:
-    with open(MODEL_PATH, 'rb') as f:
-        saved_model = pickle.load(f)
-        model = saved_model['model']
-        scaler = saved_model['scaler']
-    print("Machine Learning model and scaler loaded successfully.")
+    model = load_model(COMPILED_MODEL_PATH, MODEL_PATH)
+    # Identifies this exact model; a retrain invalidates cached verdicts.
+    model_version = model.version
+    print(f"Machine Learning model loaded successfully ({type(model).__name__}).")
 except FileNotFoundError:
-    print(f"FATAL: Model file not found at {MODEL_PATH}. Please run train_model.py first.")
-    model = scaler = None
+    model_error = f"No trained model found ({COMPILED_MODEL_PATH} or {MODEL_PATH}). {RETRAIN_HINT}"
+except ValueError as e:
+    model_error = f"{e} {RETRAIN_HINT}"
 except Exception as e:
-    print(f"Error loading model: {e}")
-    model = scaler = None
+    model_error = f"Error loading model: {e}"
+if model_error:
+    print(f"FATAL: {model_error}")
+
+model_reload_lock = threading.Lock()
+model_watcher_pid = None
+
+def reload_model() -> bool:
+    """
+    Loads the model files if they changed since the last load and swaps the
+    new model in with a single assignment. Requests already running finish
+    on the model they started with. A model that fails to load or does not
+    match the feature extractor is not swapped in; the current one keeps
+    serving. Returns True when a new model was swapped in.
+    """
+    global model, model_version, model_error, model_stamp
+    with model_reload_lock:
+        stamp = model_files_stamp()
+        if stamp == model_stamp:
+            return False
+        model_stamp = stamp
+        try:
+            loaded = load_model(COMPILED_MODEL_PATH, MODEL_PATH)
+        except Exception as e:
+            print(f"Model reload failed, keeping model {model_version}: {e}")
+            service_metrics.inc('pramaan_model_reloads_total', result='failed')
+            return False
+        if loaded.version == model_version:
+            return False
+        # Verdicts are cached per model version, so the new model starts with a cold cache.
+        model, model_version, model_error = loaded, loaded.version, None
+        print(f"Reloaded model {model_version} ({type(model).__name__}).")
+        service_metrics.inc('pramaan_model_reloads_total', result='ok')
+        return True
+
+def watch_model_files():
+    while True:
+        time.sleep(MODEL_RELOAD_SECONDS)
+        reload_model()
+        if template_index is not None:
+            template_index.refresh()
+
+# Perceptual hashes of the dataset's known certificates (built by
+# phash_index.py, memory-mapped, refreshed along with the model files). An
+# image that is a near-duplicate of a known fake is settled before OCR and
+# forensics. PRAMAAN_TEMPLATE_MATCHING=0 turns this off.
+template_index = TemplateIndex() if os.environ.get('PRAMAAN_TEMPLATE_MATCHING', '1') == '1' else None
+
+# Adjudicated verdicts for retraining (train_rl_model.py --feedback). They
+# become training labels, so /ai/feedback is disabled (403) unless
+# PRAMAAN_FEEDBACK_TOKEN is set, and then requires it in X-Pramaan-Token.
+feedback_log = FeedbackLog()
+FEEDBACK_TOKEN = os.environ.get('PRAMAAN_FEEDBACK_TOKEN') or None
 
 # -----------------------------------------------------------------------------
-# Feature Extraction (Must be IDENTICAL to the trainer)
+# Document Pre-processing (features come from the shared pramaan_features module)
 # -----------------------------------------------------------------------------
-def handle_pdf_conversion(pdf_path: str) -> str:
-    """Converts the first page of a PDF to a PNG image for analysis."""
-    global poppler_path
+@contextmanager
+def stage(timings: dict, name: str):
+    """Adds the wall time of the block, in ms, to timings[name] (no-op when timings is None)."""
+    started = time.perf_counter()
     try:
-        images = convert_from_path(pdf_path, first_page=1, last_page=1, poppler_path=poppler_path if 'poppler_path' in globals() else None)
-        if not images: return None
-        image_path = pdf_path + ".png"
-        images[0].save(image_path, 'PNG')
-        return image_path
-    except Exception as e:
-        print(f"PDF conversion failed: {e}")
-        return None
+        yield
+    finally:
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + 1000.0 * (time.perf_counter() - started)
 
-def is_certificate(filepath: str) -> tuple[bool, str]:
-    """Uses OCR with preprocessing to check for certificate keywords."""
+PDF_PROTOCOL_REASONS = [
+    "The document was identified as a certificate based on its content.",
+    "WARNING: This file is a PDF or has the signature of a converted document. Advanced forensic analysis for tampering is less reliable. Manual verification is advised."
+]
+
+def handle_pdf_conversion(raw: bytes, sha: str, timings: dict = None) -> dict:
+    """
+    Screens the selected pages of an in-memory PDF (PRAMAAN_PDF_PAGES) and
+    aggregates them into one verdict: the document passes when any page is
+    certificate content. Pages with an embedded text layer are checked from
+    that text without rendering or OCR; the rest are rasterized in memory,
+    a chunk at a time, and go through the OCR gate. Metrics come from the
+    first page that passes. Stage durations are added to `timings` if given.
+    """
+    fd, pdf_path = tempfile.mkstemp(suffix='.pdf', dir=SPILL_DIR)
     try:
-        image = cv2.imread(filepath)
-        if image is None: return False, "Invalid image format."
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        thresh = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
-        text = pytesseract.image_to_string(thresh, timeout=10)
-        keywords = ['certificate', 'completion', 'award', 'certify', 'diploma', 'training', 'course', 'successfully completed']
-        if any(keyword in text.lower() for keyword in keywords):
-            return True, "Certificate keywords found."
-        else:
-            return False, "Content Analysis Failed: The document does not contain certificate-related keywords."
-    except pytesseract.TesseractNotFoundError:
-        return False, "OCR Error: Tesseract is not installed or configured correctly."
-    except Exception as e:
-        return False, f"An unexpected OCR error occurred: {str(e)}"
+        with os.fdopen(fd, 'wb') as fh: fh.write(raw)
+        try:
+            with stage(timings, 'pdfTextMs'):
+                pages = pdf_pages.select_pages(pdf_pages.page_count(pdf_path, poppler_path))
+                texts = pdf_pages.text_layer(pdf_path, pages, poppler_path)
+        except Exception as e:
+            print(f"PDF conversion failed: {e}")
+            raise AnalysisError('Failed to convert PDF. Ensure Poppler is configured.', 500)
+        if not pages:
+            raise AnalysisError('The PDF has no pages to analyze.', 400)
+
+        results = {}
+        for page in pages:
+            if pdf_pages.has_text_layer(texts.get(page, '')):
+                found = has_certificate_keywords(texts[page])
+                results[page] = (found, FOUND_MESSAGE if found else NOT_FOUND_MESSAGE, 'textLayer')
+        # Only scanned pages need rendering, plus the first text page that passed (for metrics).
+        to_render = [p for p in pages if p not in results]
+        passed_text = [p for p in pages if p in results and results[p][0]]
+        if passed_text:
+            to_render = sorted(set(to_render + passed_text[:1]))
+
+        metrics, maps = None, {}
+        try:
+            rendered = pdf_pages.iter_pages(pdf_path, to_render, poppler_path)
+            while True:
+                # Rendering overlaps with analysis; this is the time spent waiting for a page.
+                with stage(timings, 'pdfRenderMs'):
+                    page, image = next(rendered, (None, None))
+                if page is None: break
+                if page not in results:
+                    with stage(timings, 'ocrMs'):
+                        results[page] = (*gate_check(image, cache_key=f'{sha}:p{page}'), 'ocr')
+                if metrics is None and results[page][0]:
+                    # A rendered page has no file container, hence no EXIF.
+                    metrics = extract_metrics(None, image=image, timings=timings, maps=maps)[1]
+        except (ImageTooLargeError, AnalysisError):
+            raise
+        except Exception as e:
+            print(f"PDF conversion failed: {e}")
+            raise AnalysisError('Failed to convert PDF. Ensure Poppler is configured.', 500)
+    finally:
+        os.remove(pdf_path)
 
-def get_ela_metrics(filepath: str) -> dict:
-    TEMP_ELA_FILE = filepath + '.ela.tmp.jpg'
+    page_reports = [{'page': p, 'isCertificate': results[p][0], 'source': results[p][2], 'reason': results[p][1]} for p in pages if p in results]
+    passed = [r for r in page_reports if r['isCertificate']]
+    if not passed:
+        return {'status': 'rejected', 'tamperLikely': True, 'confidence': 1.0, 'reasons': [page_reports[0]['reason']], 'pages': page_reports}
+    if metrics is None:
+        raise AnalysisError('Could not extract features from image.', 400)
+    # For PDFs, we cannot reliably use the ML model. The verdict is based on passing the OCR check.
+    return {
+        'sha256': sha,
+        'tamperLikely': False,
+        'confidence': 0.80, # Lower confidence to indicate uncertainty
+        'reasons': PDF_PROTOCOL_REASONS + [f"{len(passed)} of {len(page_reports)} analyzed pages contain certificate content."],
+        'metrics': metrics,
+        'anomaly': anomaly_summary(maps),
+        'pages': page_reports,
+        'status': 'success'
+    }
+
+# -----------------------------------------------------------------------------
+# Verification Pipeline (shared by the single and batch endpoints)
+# -----------------------------------------------------------------------------
+class AnalysisError(Exception):
+    """A per-document failure, carrying the HTTP status /ai/check reports for it."""
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+def gate_check(image: np.ndarray, cache_key: str) -> tuple[bool, str]:
+    """certificate_gate.check, with an OCR failure raised as a 503 AnalysisError so the verdict is never cached."""
     try:
-        original = Image.open(filepath)
-        if original.mode != 'RGB': original = original.convert('RGB')
-        original.save(TEMP_ELA_FILE, 'JPEG', quality=95)
-        original_cv, resaved_cv = cv2.imread(filepath), cv2.imread(TEMP_ELA_FILE)
-        diff = cv2.absdiff(original_cv, resaved_cv)
-        return { 'ela_mean': float(diff.mean()), 'ela_std': float(diff.std()), 'ela_max': float(diff.max()), 'ela_contrast': float(diff.max()) - float(diff.min()) }
-    except Exception:
-        return {'ela_mean': 0.0, 'ela_std': 0.0, 'ela_max': 0.0, 'ela_contrast': 0.0}
-
-def analyze_exif(filepath: str) -> dict:
+        return certificate_gate.check(image, cache_key=cache_key)
+    except OCRError as e:
+        service_metrics.inc('pramaan_ocr_errors_total')
+        raise AnalysisError(str(e), 503)
+
+def read_upload(f) -> tuple[bytes, str]:
+    """Returns an uploaded file's bytes and SHA-256 (already computed while it was received)."""
+    if isinstance(f.stream, HashingBuffer):
+        return f.stream.getvalue(), f.stream.sha256.hexdigest()
+    raw = f.read()
+    return raw, hashlib.sha256(raw).hexdigest()
+
+def screen_document(raw: bytes, filename: str, sha: str, timings: dict = None):
+    """
+    Runs everything before the model for one in-memory upload: PDF
+    conversion, the OCR gate and feature extraction. Returns
+    (verdict, None, None) when the document is settled without the model,
+    otherwise (None, features, details), where details holds the verdict's
+    'metrics' and 'anomaly' entries. Raises AnalysisError or
+    ImageTooLargeError. Stage durations are added to `timings` if given.
+    """
+    if filename.lower().endswith('.pdf') or raw.startswith(b'%PDF-'):
+        return handle_pdf_conversion(raw, sha, timings), None, None
+    # Decode once, within the resolution budget; OCR and features share it.
+    with stage(timings, 'decodeMs'):
+        image = load_image(raw)
+    if image is None:
+        return {'status': 'rejected', 'tamperLikely': True, 'confidence': 1.0, 'reasons': ["Invalid image format."]}, None, None
+
+    if template_index is not None and len(template_index):
+        with stage(timings, 'templateMs'):
+            nearest = template_index.nearest(image)
+        # A tampered copy of a real certificate is a near-duplicate of it too, so
+        # only a match that is closer to a known fake than to any known real counts.
+        if nearest['fake'] is not None and (nearest['real'] is None or nearest['fake'] < nearest['real']):
+            return {
+                'sha256': sha,
+                'tamperLikely': True,
+                'confidence': 1.0 - nearest['fake'] / 64,
+                'reasons': [f"The document matches a known fake template (perceptual hash distance {nearest['fake']} of 64)."],
+                'templateMatch': {'label': 'fake', 'distance': nearest['fake'], 'realDistance': nearest['real']},
+                'status': 'success'
+            }, None, None
+
+    # Run OCR check first, as it's our gatekeeper for all file types.
+    with stage(timings, 'ocrMs'):
+        is_cert, ocr_message = gate_check(image, cache_key=sha)
+    if not is_cert:
+        return {'status': 'rejected', 'tamperLikely': True, 'confidence': 1.0, 'reasons': [ocr_message]}, None, None
+
+    # Extract features for all file types that pass OCR.
+    maps = {}
+    features, metrics = extract_metrics(raw, image=image, timings=timings, maps=maps)
+    if features is None:
+        raise AnalysisError('Could not extract features from image.', 400)
+
+    # --- NEW: PDF Protocol Logic ---
+    # A converted PDF will have a unique forensic signature. We check for it here.
+    is_converted_pdf_signature = (metrics.get('laplacian_variance', 0) > 800 and
+        metrics.get('ela_mean', 10) < 2.0 and
+        metrics.get('has_date_info', 1) == 0.0)
+
+    if is_converted_pdf_signature:
+        # For PDFs, we cannot reliably use the ML model. The verdict is based on passing the OCR check.
+        return {
+            'sha256': sha,
+            'tamperLikely': False,
+            'confidence': 0.80, # Lower confidence to indicate uncertainty
+            'reasons': PDF_PROTOCOL_REASONS,
+            'metrics': metrics,
+            'anomaly': anomaly_summary(maps),
+            'status': 'success'
+        }, None, None
+    return None, features, {'metrics': metrics, 'anomaly': anomaly_summary(maps)}
+
+def settled_outcome(verdict: dict) -> str:
+    """Metrics outcome label of a verdict reached without the model."""
+    if verdict['status'] == 'rejected': return 'rejected'
+    return 'template_match' if 'templateMatch' in verdict else 'pdf_protocol'
+
+def classify(current_model, features: np.ndarray, shas: list, details_list: list) -> list:
+    """Scores a stacked (N, NUM_FEATURES) matrix with one model call and returns N verdicts."""
+    labels, probabilities = current_model.predict(features)
+    verdicts = []
+    for sha, details, label, proba in zip(shas, details_list, labels, probabilities):
+        prediction = int(label)
+        tamper_likely = bool(prediction == 1)
+        confidence = float(proba[prediction])
+        verdicts.append({
+            'sha256': sha,
+            'tamperLikely': tamper_likely,
+            'confidence': confidence,
+            'reasons': [f"The model predicts this certificate is {'FAKE' if tamper_likely else 'REAL'} with {confidence:.2%} confidence."],
+            **details,
+            'status': 'success'
+        })
+    return verdicts
+
+def public_verdict(verdict: dict, heatmap: bool) -> dict:
+    """The verdict as returned to the client: the anomaly heatmap is only included on request (?heatmap=1)."""
+    if heatmap or not verdict.get('anomaly'):
+        return verdict
+    return {**verdict, 'anomaly': {k: v for k, v in verdict['anomaly'].items() if k != 'heatmap'}}
+
+def upload_bytes(raw: bytes) -> bytes:
+    if len(raw) > MAX_UPLOAD_BYTES:
+        raise AnalysisError('File exceeds the upload size limit.', 413)
+    return raw
+
+def read_zip_member(archive: zipfile.ZipFile, info: zipfile.ZipInfo) -> bytes:
+    """
+    Decompresses one archive member, reading no more than MAX_UPLOAD_BYTES + 1
+    bytes whatever its header declares. A member that cannot be read (bad CRC,
+    encrypted, unsupported compression) raises AnalysisError.
+    """
+    if info.file_size > MAX_UPLOAD_BYTES:
+        raise AnalysisError('File exceeds the upload size limit.', 413)
     try:
-        exif_dict = piexif.load(filepath)
-        software_tag_present = 1 if piexif.ImageIFD.Software in exif_dict['0th'] else 0
-        has_date_info = 1 if piexif.ImageIFD.DateTime in exif_dict['0th'] else 0
-        return {'software_tag': float(software_tag_present), 'has_date_info': float(has_date_info)}
-    except Exception:
-        return {'software_tag': 1.0, 'has_date_info': 0.0}
-
-def analyze_forensic_metrics(image: np.ndarray) -> dict:
-    b, g, r = cv2.split(image)
-    std_dev_r, std_dev_g, std_dev_b = float(np.std(r)), float(np.std(g)), float(np.std(b))
-    corr_gb = np.corrcoef(g.flatten(), b.flatten())[0, 1]
-    corr_gr = np.corrcoef(g.flatten(), r.flatten())[0, 1]
-    corr_br = np.corrcoef(b.flatten(), r.flatten())[0, 1]
-    avg_corr = (corr_gb + corr_gr + corr_br) / 3.0
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    noise_variance = np.var(gray - cv2.GaussianBlur(gray, (5, 5), 0))
-    laplacian_variance = np.var(cv2.Laplacian(gray, cv2.CV_64F))
-    return { 'laplacian_variance': float(laplacian_variance), 'noise_variance': float(noise_variance), 'cross_channel_correlation': float(avg_corr) if not np.isnan(avg_corr) else 0.0, 'std_dev_r': std_dev_r, 'std_dev_g': std_dev_g, 'std_dev_b': std_dev_b }
-
-def extract_features(filepath: str):
+        with archive.open(info) as fh:
+            raw = fh.read(MAX_UPLOAD_BYTES + 1)
+    except (zipfile.BadZipFile, RuntimeError, NotImplementedError, EOFError, OSError, zlib.error) as e:
+        raise AnalysisError(f'Could not read the file from the archive: {e}', 400)
+    return upload_bytes(raw)
+
+def read_batch_items(files) -> list:
+    """
+    Flattens the uploaded files and the members of any .zip into
+    [(filename, read, sha256 or None)], where read() returns the file's bytes
+    or raises AnalysisError (e.g. over MAX_UPLOAD_BYTES). Archive members are
+    only listed here; each is decompressed when it is screened, so a batch
+    holds at most one member per screening thread in memory. Raises
+    zipfile.BadZipFile if an archive's directory cannot be read.
+    """
+    items = []
+    for f in files:
+        if f.filename == '': continue
+        if not f.filename.lower().endswith('.zip'):
+            raw, sha = read_upload(f)
+            items.append((f.filename, partial(upload_bytes, raw), sha))
+            continue
+        # Members are read while the response streams, after the request has
+        # closed its files, so the archive takes the upload's buffer over. It
+        # is released with the archive once the last member has been screened.
+        stream, f.stream = f.stream, io.BytesIO()
+        archive = zipfile.ZipFile(stream)
+        for info in archive.infolist():
+            name = os.path.basename(info.filename)
+            if info.is_dir() or not name or info.filename.startswith('__MACOSX/'): continue
+            items.append((name, partial(read_zip_member, archive, info), None))
+    return items
+
+def _verify_document(raw: bytes, filename: str, sha: str, timings: dict) -> tuple[dict, int, str]:
+    # One model for the whole document, even if a reload swaps it mid-request.
+    current_model = model
+    with stage(timings, 'cacheMs'):
+        cached = verdict_cache.get(sha, current_model.version)
+    if cached is not None:
+        return {**cached, 'cached': True}, 200, 'cache_hit'
     try:
-        ela_metrics = get_ela_metrics(filepath)
-        exif_metrics = analyze_exif(filepath)
-        image = cv2.imread(filepath)
-        if image is None: return None, None
-        other_metrics = analyze_forensic_metrics(image)
-        full_metrics = {**ela_metrics, **exif_metrics, **other_metrics}
-        
-        feature_vector = np.array([[ 
-            ela_metrics['ela_mean'], ela_metrics['ela_std'], ela_metrics['ela_max'], ela_metrics['ela_contrast'], 
-            other_metrics['laplacian_variance'], other_metrics['noise_variance'], 
-            other_metrics['cross_channel_correlation'], other_metrics['std_dev_r'], 
-            other_metrics['std_dev_g'], other_metrics['std_dev_b'], 
-            exif_metrics['software_tag'], exif_metrics['has_date_info'] 
-        ]])
-        return feature_vector, full_metrics
-    except Exception:
-        return None, None
+        verdict, features, details = screen_document(raw, filename, sha, timings)
+        if verdict is None:
+            # This is a standard image, so we use the full power of the ML model.
+            with stage(timings, 'modelMs'):
+                verdict = classify(current_model, features.reshape(1, -1), [sha], [details])[0]
+            outcome = 'model_fake' if verdict['tamperLikely'] else 'model_real'
+        else:
+            outcome = settled_outcome(verdict)
+        verdict_cache.put(sha, current_model.version, verdict)
+        return verdict, 200, outcome
+    except AnalysisError as e:
+        return {'error': str(e)}, e.status, 'error'
+    except ImageTooLargeError as e:
+        return {'error': f'Image is too large to analyze. {e}'}, 413, 'error'
+    except Exception as e:
+        return {'error': f'An unexpected error occurred: {str(e)}'}, 500, 'error'
+
+def verify_document(raw: bytes, filename: str, sha: str, timings: dict = None, heatmap: bool = False) -> tuple[dict, int]:
+    """The full single-document pipeline behind /ai/check and its jobs: returns (response body, HTTP status)."""
+    timings = {} if timings is None else timings
+    with stage(timings, 'pipelineMs'):
+        body, status, outcome = _verify_document(raw, filename, sha, timings)
+    record_outcome(outcome, status, timings)
+    return public_verdict(body, heatmap), status
+
+def record_outcome(outcome: str, status: int, timings: dict):
+    service_metrics.observe_timings(timings)
+    service_metrics.inc('pramaan_verdicts_total', outcome=outcome)
+    if status >= 400:
+        service_metrics.inc('pramaan_errors_total', code=status)
+
+# Asynchronous /ai/check (?async=1): bounded queue, polled at /ai/jobs/<id>.
+# Set PRAMAAN_JOB_DB so that every worker process can answer a poll. A
+# callbackUrl must resolve to public addresses, unless PRAMAAN_CALLBACK_HOSTS
+# (comma-separated; '.example.com' includes subdomains) lists the allowed hosts.
+job_queue = JobQueue(
+    handler=lambda payload, timings: verify_document(**payload, timings=timings),
+    workers=int(os.environ.get('PRAMAAN_JOB_WORKERS', '2')),
+    max_pending=int(os.environ.get('PRAMAAN_JOB_QUEUE_SIZE', '64')),
+    ttl_seconds=float(os.environ.get('PRAMAAN_JOB_TTL', '3600')),
+    db_path=os.environ.get('PRAMAAN_JOB_DB') or None,
+    callback_hosts=os.environ.get('PRAMAAN_CALLBACK_HOSTS', '').split(','),
+)
 
 # -----------------------------------------------------------------------------
 # Flask API Routes
 # -----------------------------------------------------------------------------
+@app.before_request
+def start_model_watcher():
+    # Started by the first request, so that each pre-forked worker runs its own.
+    global model_watcher_pid
+    if MODEL_RELOAD_SECONDS > 0 and model_watcher_pid != os.getpid():
+        with model_reload_lock:
+            if model_watcher_pid != os.getpid():
+                threading.Thread(target=watch_model_files, name='pramaan-model-watcher', daemon=True).start()
+                model_watcher_pid = os.getpid()
+
 @app.route('/ai/check', methods=['POST'])
 def ai_check():
-    if model is None or scaler is None:
-        return jsonify({'error': 'ML model or scaler is not loaded.'}), 503
+    """
+    Verifies one certificate. With ?async=1 the document is queued instead:
+    202 with a job id (optionally POSTing the result to the 'callbackUrl'
+    form field when done), or 429 with Retry-After while the queue is full.
+    With ?heatmap=1 the verdict's 'anomaly' entry includes the tile heatmap.
+    """
+    if model is None:
+        return jsonify({'error': model_error or 'ML model or scaler is not loaded.'}), 503
+    if (request.content_length or 0) > MAX_UPLOAD_BYTES:
+        return upload_too_large(None)
 
-    if 'certificate' not in request.files:
+    timings = {}
+    with stage(timings, 'uploadMs'):
+        # Receiving (and hashing) the multipart body happens here.
+        has_file = 'certificate' in request.files
+    if not has_file:
         return jsonify({'error': 'No file part'}), 400
     f = request.files['certificate']
     if f.filename == '':
         return jsonify({'error': 'No selected file'}), 400
 
-    filename = secure_filename(f.filename)
-    filepath = os.path.join(UPLOAD_DIR, filename)
-    f.save(filepath)
-    
-    analysis_path = filepath
-    is_pdf = filename.lower().endswith('.pdf')
-    if is_pdf:
-        analysis_path = handle_pdf_conversion(filepath)
-        if not analysis_path:
-            return jsonify({'error': 'Failed to convert PDF. Ensure Poppler is configured.'}), 500
+    # The hash is ready before any expensive work, so a re-submitted file is answered from the cache.
+    raw, sha = read_upload(f)
+    if len(raw) > MAX_UPLOAD_BYTES:
+        return upload_too_large(None)
+
+    heatmap = request.args.get('heatmap', '').lower() in ('1', 'true', 'yes')
+    if request.args.get('async', '').lower() in ('1', 'true', 'yes'):
+        callback_url = request.form.get('callbackUrl') or None
+        callback_error = job_queue.callback_error(callback_url) if callback_url else None
+        if callback_error:
+            return jsonify({'error': callback_error}), 400
+        try:
+            job = job_queue.submit({'raw': raw, 'filename': f.filename, 'sha': sha, 'heatmap': heatmap}, callback_url=callback_url)
+        except QueueFullError as e:
+            retry_after = job_queue.retry_after()
+            return jsonify({'error': str(e), 'retryAfter': retry_after}), 429, {'Retry-After': str(retry_after)}
+        job['statusUrl'] = f"/ai/jobs/{job['jobId']}"
+        return jsonify(job), 202, {'Location': job['statusUrl']}
+
+    headers = {}
+    if PROFILING_ENABLED and request.headers.get('X-Pramaan-Profile') == '1':
+        with SamplingProfiler() as profiler:
+            body, status = verify_document(raw, f.filename, sha, timings, heatmap)
+        headers['X-Pramaan-Profile'] = os.path.basename(profiler.save(PROFILE_DIR, f'{sha[:16]}-{int(time.time() * 1000)}'))
+    else:
+        body, status = verify_document(raw, f.filename, sha, timings, heatmap)
+    if TIMING_HEADER or request.headers.get('X-Pramaan-Timing') == '1':
+        headers['X-Pramaan-Timing'] = format_timing_header(timings)
+    return jsonify(body), status, headers
 
+@app.route('/ai/jobs/<job_id>', methods=['GET'])
+def ai_job(job_id):
+    """Status of an asynchronous check: queued, running, done or failed, with its result and stage timings."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job id.'}), 404
+    return jsonify(job)
+
+def featurize_upload(raw: bytes, filename: str):
+    """
+    Feature vector of an uploaded document the way the trainer featurizes
+    dataset files (PDFs by their first page), or None. Raises ImageTooLargeError.
+    """
+    if not (filename.lower().endswith('.pdf') or raw.startswith(b'%PDF-')):
+        return extract_metrics(raw)[0]
+    fd, pdf_path = tempfile.mkstemp(suffix='.pdf', dir=SPILL_DIR)
     try:
-        # Run OCR check first, as it's our gatekeeper for all file types.
-        is_cert, ocr_message = is_certificate(analysis_path)
-        if not is_cert:
-            return jsonify({'status': 'rejected', 'tamperLikely': True, 'confidence': 1.0, 'reasons': [ocr_message]})
+        with os.fdopen(fd, 'wb') as fh: fh.write(raw)
+        page = pdf_pages.render_page(pdf_path, 1, poppler_path)
+    except ImageTooLargeError:
+        raise
+    except Exception as e:
+        print(f"PDF conversion failed: {e}")
+        return None
+    finally:
+        os.remove(pdf_path)
+    return extract_metrics(None, image=page)[0]
 
-        # Extract features for all file types that pass OCR.
-        features, metrics = extract_features(analysis_path)
+@app.route('/ai/feedback', methods=['POST'])
+def ai_feedback():
+    """
+    Records a reviewer's final label ('real' or 'fake') for a document in the
+    feedback log. The document is named by 'sha256' when this service has a
+    cached image verdict for it (its features are taken from the verdict),
+    or uploaded again as the 'certificate' file. Fields may be sent as JSON
+    or as form data. Requires PRAMAAN_FEEDBACK_TOKEN (403 when unset).
+    """
+    if FEEDBACK_TOKEN is None:
+        return jsonify({'error': 'Feedback is disabled on this server (PRAMAAN_FEEDBACK_TOKEN is not set).'}), 403
+    if not hmac.compare_digest(request.headers.get('X-Pramaan-Token', ''), FEEDBACK_TOKEN):
+        return jsonify({'error': 'Invalid or missing X-Pramaan-Token.'}), 401
+    data = request.get_json(silent=True) or request.form
+    label = parse_label(data.get('label', ''))
+    if label is None:
+        return jsonify({'error': "label must be 'real' or 'fake'."}), 400
+
+    f = request.files.get('certificate')
+    if f is not None and f.filename != '':
+        raw, sha = read_upload(f)
+        if len(raw) > MAX_UPLOAD_BYTES:
+            return upload_too_large(None)
+        try:
+            features = featurize_upload(raw, f.filename)
+        except ImageTooLargeError as e:
+            return jsonify({'error': f'Image is too large to analyze. {e}'}), 413
+        if features is None:
+            return jsonify({'error': 'Could not extract features from the document.'}), 400
+    else:
+        sha = str(data.get('sha256', '')).strip().lower()
+        if len(sha) != 64 or any(c not in '0123456789abcdef' for c in sha):
+            return jsonify({'error': "Send the document as 'certificate' or its 'sha256'."}), 400
+        current_model = model
+        cached = verdict_cache.get(sha, current_model.version) if current_model is not None else None
+        # PDF verdicts carry the metrics of the first passing page, which need not be the page the trainer uses.
+        features = None
+        if cached and cached.get('metrics') and 'pages' not in cached:
+            try:
+                features = metrics_to_vector(cached['metrics'])
+            except KeyError:
+                features = None
         if features is None:
-            return jsonify({'error': 'Could not extract features from image.'}), 400
-
-        # --- NEW: PDF Protocol Logic ---
-        # A converted PDF will have a unique forensic signature. We check for it here.
-        is_converted_pdf_signature = is_pdf or \
-            (metrics.get('laplacian_variance', 0) > 800 and 
-             metrics.get('ela_mean', 10) < 2.0 and 
-             metrics.get('has_date_info', 1) == 0.0)
-
-        if is_converted_pdf_signature:
-            # For PDFs, we cannot reliably use the ML model. The verdict is based on passing the OCR check.
-            tamper_likely = False
-            confidence = 0.80 # Lower confidence to indicate uncertainty
-            reasons = [
-                "The document was identified as a certificate based on its content.",
-                "WARNING: This file is a PDF or has the signature of a converted document. Advanced forensic analysis for tampering is less reliable. Manual verification is advised."
-            ]
+            return jsonify({'error': "No stored features for this document; upload it as 'certificate'."}), 404
+
+    feedback_log.append(sha, features, label)
+    service_metrics.inc('pramaan_feedback_total', label='fake' if label else 'real')
+    return jsonify({'sha256': sha, 'label': 'fake' if label else 'real', 'logged': True}), 201
+
+@app.route('/ai/check/batch', methods=['POST'])
+def ai_check_batch():
+    """
+    Verifies many certificates (multiple 'certificates' files and/or .zip
+    archives) and streams one NDJSON line per file. Files settled without the
+    model are streamed as soon as they finish; the rest are scored together
+    with a single model call. Failures are reported inline. ?heatmap=1 works
+    as for /ai/check.
+    """
+    current_model = model
+    if current_model is None:
+        return jsonify({'error': model_error or 'ML model or scaler is not loaded.'}), 503
+    try:
+        items = read_batch_items(request.files.getlist('certificates'))
+    except zipfile.BadZipFile:
+        return jsonify({'error': 'Uploaded archive is not a valid zip file.'}), 400
+    if not items:
+        return jsonify({'error': 'No files in batch'}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({'error': f'Batch has {len(items)} files; the limit is {BATCH_MAX_ITEMS}.'}), 413
+    heatmap = request.args.get('heatmap', '').lower() in ('1', 'true', 'yes')
+
+    def screen(read, filename: str, sha: str):
+        raw = read()
+        sha = sha or hashlib.sha256(raw).hexdigest()
+        timings = {}
+        with stage(timings, 'cacheMs'):
+            cached = verdict_cache.get(sha, current_model.version)
+        if cached is not None:
+            record_outcome('cache_hit', 200, timings)
+            return {**cached, 'cached': True}, sha, None, None
+        verdict, features, details = screen_document(raw, filename, sha, timings)
+        if verdict is not None:
+            verdict_cache.put(sha, current_model.version, verdict)
+            record_outcome(settled_outcome(verdict), 200, timings)
         else:
-            # This is a standard image, so we use the full power of the ML model.
-            features_scaled = scaler.transform(features)
-            prediction = model.predict(features_scaled)[0]
-            probabilities = model.predict_proba(features_scaled)[0]
-
-            tamper_likely = bool(prediction == 1)
-            confidence = float(probabilities[prediction])
-            reasons = [f"The model predicts this certificate is {'FAKE' if tamper_likely else 'REAL'} with {confidence:.2%} confidence."]
-        
-        with open(filepath, 'rb') as fh: raw = fh.read()
-        sha = hashlib.sha256(raw).hexdigest()
-
-        return jsonify({
-            'sha256': sha,
-            'tamperLikely': tamper_likely,
-            'confidence': confidence,
-            'reasons': reasons,
-            'metrics': metrics,
-            'status': 'success'
-        })
-    except Exception as e:
-        return jsonify({'error': f'An unexpected error occurred: {str(e)}'}), 500
-    finally:
-        if os.path.exists(filepath):
-            os.remove(filepath)
-        if is_pdf and analysis_path and os.path.exists(analysis_path) and analysis_path != filepath:
-            os.remove(analysis_path)
+            # The model stage is recorded once for the whole batch.
+            service_metrics.observe_timings(timings)
+        return verdict, sha, features, details
+
+    def generate():
+        futures = {batch_executor.submit(screen, read, name, sha): (i, name) for i, (name, read, sha) in enumerate(items)}
+        pending, failed = [], 0
+        for future in as_completed(futures):
+            index, name = futures[future]
+            try:
+                verdict, sha, features, details = future.result()
+            except AnalysisError as e:
+                verdict = {'status': 'error', 'error': str(e), 'code': e.status}
+            except ImageTooLargeError as e:
+                verdict = {'status': 'error', 'error': f'Image is too large to analyze. {e}', 'code': 413}
+            except Exception as e:
+                verdict = {'status': 'error', 'error': f'An unexpected error occurred: {str(e)}', 'code': 500}
+            if verdict is None:
+                pending.append((index, name, sha, features, details))
+                continue
+            if verdict['status'] == 'error':
+                failed += 1
+                record_outcome('error', verdict['code'], {})
+            yield json.dumps({'index': index, 'filename': name, **public_verdict(verdict, heatmap)}) + '\n'
+
+        if pending:
+            timings = {}
+            try:
+                with stage(timings, 'batchModelMs'):
+                    verdicts = classify(current_model, np.stack([p[3] for p in pending]), [p[2] for p in pending], [p[4] for p in pending])
+            except Exception as e:
+                verdicts = [{'status': 'error', 'error': f'Model inference failed: {str(e)}', 'code': 500}] * len(pending)
+            service_metrics.observe_timings(timings)
+            for (index, name, sha, _, _), verdict in zip(pending, verdicts):
+                if verdict['status'] == 'error':
+                    failed += 1
+                    record_outcome('error', 500, {})
+                else:
+                    verdict_cache.put(sha, current_model.version, verdict)
+                    record_outcome('model_fake' if verdict['tamperLikely'] else 'model_real', 200, {})
+                yield json.dumps({'index': index, 'filename': name, **public_verdict(verdict, heatmap)}) + '\n'
+        yield json.dumps({'batchComplete': True, 'total': len(items), 'failed': failed}) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    limit = MAX_BATCH_BYTES if request.path == '/ai/check/batch' else MAX_UPLOAD_BYTES
+    return jsonify({'error': f"Upload exceeds the {limit // (1024 * 1024)} MB limit."}), 413
+
+@app.after_request
+def count_request(response):
+    service_metrics.inc('pramaan_requests_total', endpoint=request.endpoint or 'unknown', code=response.status_code)
+    return response
+
+@app.route('/ai/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus text exposition of this worker's stage latencies, counters and cache statistics."""
+    cache, gate, jobs = verdict_cache.stats(), certificate_gate.stats(), job_queue.stats()
+    extra = {
+        'pramaan_model_loaded': ('gauge', 'Whether a model is loaded, labelled with its version.', [({'version': model_version or ''}, int(model is not None))]),
+        'pramaan_verdict_cache_hits_total': ('counter', 'Verdict cache hits.', [({}, cache['hits'])]),
+        'pramaan_verdict_cache_misses_total': ('counter', 'Verdict cache misses.', [({}, cache['misses'])]),
+        'pramaan_verdict_cache_entries': ('gauge', 'Verdicts held in memory.', [({}, cache['entries'])]),
+        'pramaan_ocr_gate_calls_total': ('counter', 'OCR gate lookups per tier.', [({'tier': t}, gate[t]['calls']) for t in certificate_gate.TIERS]),
+        'pramaan_ocr_gate_hits_total': ('counter', 'OCR gate hits per tier (keyword found or cache hit).', [({'tier': t}, gate[t]['hits']) for t in certificate_gate.TIERS]),
+        'pramaan_job_queue_pending': ('gauge', 'Jobs waiting in the queue.', [({}, jobs['pending'])]),
+        'pramaan_job_queue_rejected_total': ('counter', 'Jobs refused because the queue was full.', [({}, jobs['rejected'])]),
+        'pramaan_template_index_entries': ('gauge', 'Known certificates in the template index.', [({}, len(template_index) if template_index is not None else 0)]),
+        'pramaan_template_matches_total': ('counter', 'Template index lookups with at least one near-duplicate.', [({}, template_index.matches if template_index is not None else 0)]),
+        'pramaan_feedback_log_records': ('gauge', 'Records in the feedback log, from all workers.', [({}, feedback_log.stats()['records'])]),
+    }
+    return Response(service_metrics.render(extra), mimetype='text/plain; version=0.0.4')
 
 @app.route('/ai/health', methods=['GET'])
 def health_check():
     status = 'healthy' if model is not None else 'degraded (ML model not loaded)'
-    return jsonify({'status': status, 'service': 'Pramaan AI Detector (Definitive Edition)'})
+    return jsonify({'status': status, 'service': 'Pramaan AI Detector (Definitive Edition)', 'modelVersion': model_version, 'verdictCache': verdict_cache.stats(), 'ocrGate': certificate_gate.stats(), 'jobQueue': job_queue.stats(), 'feedback': feedback_log.stats(), 'templateIndex': template_index.stats() if template_index is not None else None, 'stages': service_metrics.stage_report()})
+
+@app.route('/ai/health/live', methods=['GET'])
+def liveness_check():
+    """The worker is up and serving requests; restart it if this fails."""
+    return jsonify({'status': 'alive', 'pid': os.getpid()})
+
+@app.route('/ai/health/ready', methods=['GET'])
+def readiness_check():
+    """The worker can verify certificates; route traffic to it only while this returns 200."""
+    if model is None:
+        return jsonify({'status': 'not ready', 'reason': model_error or 'ML model or scaler is not loaded.'}), 503
+    return jsonify({'status': 'ready', 'modelVersion': model_version})
 
 if __name__ == '__main__':
+    # Development server. In production run: gunicorn -c gunicorn.conf.py app_rl:app
     port = int(os.environ.get('AI_PORT', '5011'))
     app.run(host='0.0.0.0', port=port)
 
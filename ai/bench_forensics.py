@@ -0,0 +1,92 @@
+# -----------------------------------------------------------------------------
+# Pramaan Forensic Metrics - Microbenchmark
+#
+# Compares the fused single-pass statistics in pramaan_features against the
+# schema v1 implementation (kept below as a reference) on synthetic scans of
+# increasing size, and checks that both agree on the dataset images. The
+# current implementation also computes the block-wise noise statistics added
+# in schema v3, which v1 did not have; they are included in its timings.
+#
+#   python bench_forensics.py [--sizes 1 4 12] [--repeat 3]
+# -----------------------------------------------------------------------------
+
+import cv2
+import numpy as np
+import argparse
+import time
+import tracemalloc
+from pramaan_features import FEATURE_SCHEMA_VERSION, analyze_forensic_metrics
+from pramaan_dataset import REAL_PATH, FAKE_PATH, list_dataset_files
+
+# Intentionally changed in schema v2, so excluded from the equivalence check.
+CHANGED_FEATURES = {'noise_variance'}
+
+def reference_forensic_metrics(image: np.ndarray) -> dict:
+    """The schema v1 implementation, verbatim."""
+    b, g, r = cv2.split(image)
+    std_dev_r, std_dev_g, std_dev_b = float(np.std(r)), float(np.std(g)), float(np.std(b))
+    corr_gb = np.corrcoef(g.flatten(), b.flatten())[0, 1]
+    corr_gr = np.corrcoef(g.flatten(), r.flatten())[0, 1]
+    corr_br = np.corrcoef(b.flatten(), r.flatten())[0, 1]
+    avg_corr = (corr_gb + corr_gr + corr_br) / 3.0
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    noise_variance = np.var(gray - cv2.GaussianBlur(gray, (5, 5), 0))
+    laplacian_variance = np.var(cv2.Laplacian(gray, cv2.CV_64F))
+    return { 'laplacian_variance': float(laplacian_variance), 'noise_variance': float(noise_variance), 'cross_channel_correlation': float(avg_corr) if not np.isnan(avg_corr) else 0.0, 'std_dev_r': std_dev_r, 'std_dev_g': std_dev_g, 'std_dev_b': std_dev_b }
+
+def synthetic_scan(megapixels: float, seed: int = 0) -> np.ndarray:
+    """A 3:4 off-white page with dark text-like strokes and sensor noise."""
+    rng = np.random.default_rng(seed)
+    h = int(np.sqrt(megapixels * 1e6 * 4 / 3)); w = int(megapixels * 1e6 / h)
+    page = np.full((h, w, 3), (232, 238, 241), dtype=np.uint8)
+    for _ in range(200):
+        x, y = int(rng.integers(0, w)), int(rng.integers(0, h))
+        cv2.putText(page, 'CERTIFICATE', (x, y), cv2.FONT_HERSHEY_SIMPLEX, w / 1500, (40, 30, 20), max(1, w // 800))
+    noise = rng.normal(0, 4, page.shape).astype(np.int16)
+    return cv2.add(page.astype(np.int16), noise).clip(0, 255).astype(np.uint8)
+
+def measure(fn, image: np.ndarray, repeat: int) -> tuple:
+    """Best wall time over `repeat` runs and the peak traced allocation of one run."""
+    fn(image)
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(image)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    fn(image)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+def check_equivalence(limit: int = 40) -> float:
+    """Largest relative difference between both implementations over dataset images."""
+    worst = 0.0
+    for path in (list_dataset_files(REAL_PATH) + list_dataset_files(FAKE_PATH))[:limit]:
+        image = cv2.imread(path)
+        if image is None: continue
+        ref, new = reference_forensic_metrics(image), analyze_forensic_metrics(image)
+        for name in ref.keys() - CHANGED_FEATURES:
+            worst = max(worst, abs(new[name] - ref[name]) / max(abs(ref[name]), 1e-12))
+    return worst
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark analyze_forensic_metrics.")
+    parser.add_argument('--sizes', type=float, nargs='+', default=[1, 4, 12], help="Synthetic scan sizes in megapixels.")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    now = f'v{FEATURE_SCHEMA_VERSION}'
+    print(f"{'MP':>5} {'v1 ms/MP':>10} {now + ' ms/MP':>10} {'speedup':>8} {'v1 MiB/MP':>10} {now + ' MiB/MP':>10}")
+    for mp in args.sizes:
+        image = synthetic_scan(mp)
+        actual_mp = image.shape[0] * image.shape[1] / 1e6
+        t_ref, m_ref = measure(reference_forensic_metrics, image, args.repeat)
+        t_new, m_new = measure(analyze_forensic_metrics, image, args.repeat)
+        print(f"{actual_mp:5.1f} {t_ref * 1e3 / actual_mp:10.1f} {t_new * 1e3 / actual_mp:10.1f} {t_ref / t_new:7.1f}x "
+              f"{m_ref / 2**20 / actual_mp:10.1f} {m_new / 2**20 / actual_mp:10.1f}")
+
+    print(f"\nMax relative difference vs v1 on dataset images (excluding {', '.join(sorted(CHANGED_FEATURES))}): {check_equivalence():.2e}")
+
+if __name__ == '__main__':
+    main()
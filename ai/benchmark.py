@@ -0,0 +1,312 @@
+# -----------------------------------------------------------------------------
+# Pramaan AI Detector - Benchmark Suite
+#
+# Per-function throughput and peak memory for the detector's hot paths on
+# dataset images, synthetic large scans and a synthetic multi-page PDF, plus
+# a closed-loop load test of /ai/check on a locally started server. Results
+# are written as JSON; pass --baseline to compare against an earlier run.
+#
+#   python benchmark.py --output bench.json
+#   python benchmark.py --baseline bench.json --concurrency 1 4 16
+# -----------------------------------------------------------------------------
+
+import cv2
+import numpy as np
+import argparse
+import hashlib
+import io
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+import uuid
+from PIL import Image
+from pramaan_features import analyze_exif, analyze_forensic_metrics, get_ela_metrics, load_image
+from pramaan_dataset import REAL_PATH, FAKE_PATH, list_dataset_files, load_labelled_dataset
+from bench_forensics import synthetic_scan
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp')
+
+# -----------------------------------------------------------------------------
+# Inputs
+# -----------------------------------------------------------------------------
+def dataset_images(limit: int) -> list:
+    """(name, raw bytes) for up to `limit` dataset images."""
+    paths = [p for p in list_dataset_files(REAL_PATH) + list_dataset_files(FAKE_PATH) if p.lower().endswith(IMAGE_EXTENSIONS)]
+    items = []
+    for path in paths[:limit]:
+        with open(path, 'rb') as fh:
+            items.append((os.path.basename(path), fh.read()))
+    return items
+
+def encode_jpeg(image: np.ndarray, quality: int = 90) -> bytes:
+    return cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+
+def synthetic_pdf(pages: int, megapixels: float = 2.0) -> bytes:
+    """A scanned-looking PDF: one synthetic scan per page, no text layer."""
+    scans = [Image.fromarray(cv2.cvtColor(synthetic_scan(megapixels, seed=i), cv2.COLOR_BGR2RGB)) for i in range(pages)]
+    buf = io.BytesIO()
+    scans[0].save(buf, format='PDF', save_all=True, append_images=scans[1:], resolution=200)
+    return buf.getvalue()
+
+# -----------------------------------------------------------------------------
+# Per-Function Benchmarks
+# -----------------------------------------------------------------------------
+def measure(fn, inputs: list, repeat: int, megapixels: float = None) -> dict:
+    """Throughput over `repeat` passes of `inputs` (after one warm-up call) and the peak traced allocation of one pass."""
+    fn(inputs[0])
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for item in inputs:
+            fn(item)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    for item in inputs:
+        fn(item)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    calls = repeat * len(inputs)
+    result = {'calls': calls, 'callsPerSec': calls / elapsed, 'msPerCall': 1000.0 * elapsed / calls, 'peakMiB': peak / 2**20}
+    if megapixels:
+        result['megapixelsPerSec'] = repeat * megapixels / elapsed
+    return result
+
+def tesseract_available() -> bool:
+    import pytesseract
+    try:
+        pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        return False
+
+def bench_functions(args) -> dict:
+    results = {}
+    sets = {'dataset': dataset_images(args.limit)}
+    for mp in args.sizes:
+        sets[f'synthetic{mp:g}mp'] = [(f'scan{mp:g}mp.jpg', encode_jpeg(synthetic_scan(mp)))]
+    for set_name, items in sets.items():
+        if not items: continue
+        images = [img for img in (load_image(raw) for _, raw in items) if img is not None]
+        mp = sum(img.shape[0] * img.shape[1] for img in images) / 1e6
+        print(f"[{set_name}] {len(images)} images, {mp:.1f} MP after the analysis budget")
+        results[f'get_ela_metrics/{set_name}'] = measure(get_ela_metrics, images, args.repeat, mp)
+        results[f'analyze_forensic_metrics/{set_name}'] = measure(analyze_forensic_metrics, images, args.repeat, mp)
+        results[f'analyze_exif/{set_name}'] = measure(analyze_exif, [raw for _, raw in items], args.repeat)
+        if tesseract_available():
+            from ocr_gate import CertificateGate
+            gate = CertificateGate(cache_size=0)
+            results[f'is_certificate/{set_name}'] = measure(gate.check, images, 1, mp)
+        elif set_name == 'dataset':
+            print("Skipping is_certificate: Tesseract is not installed.")
+
+    if shutil.which('pdftoppm') or os.name == 'nt':
+        import app_rl
+        pdf = synthetic_pdf(args.pdf_pages)
+        sha = hashlib.sha256(pdf).hexdigest()
+        # A fresh cache key per call, so the OCR cache does not short-circuit pages.
+        results[f'handle_pdf_conversion/{args.pdf_pages}pages'] = measure(
+            lambda raw: app_rl.handle_pdf_conversion(raw, f'{sha}-{uuid.uuid4().hex}'), [pdf], 1)
+    else:
+        print("Skipping handle_pdf_conversion: poppler (pdftoppm) is not installed.")
+
+    try:
+        from pramaan_model import load_model
+        model = load_model()
+        X, _ = load_labelled_dataset()
+        results['model_inference/single'] = measure(model.predict, [x[None, :] for x in X], args.repeat)
+        results['model_inference/batch'] = measure(model.predict, [X], args.repeat * 10)
+        results['model_inference/batch']['rowsPerSec'] = results['model_inference/batch']['callsPerSec'] * len(X)
+    except Exception as e:
+        print(f"Skipping model inference: {e}")
+    return results
+
+# -----------------------------------------------------------------------------
+# Closed-Loop Load Test
+# -----------------------------------------------------------------------------
+def multipart(filename: str, raw: bytes) -> tuple:
+    boundary = uuid.uuid4().hex
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="certificate"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n').encode() + raw + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+def start_server(args) -> tuple:
+    """
+    Starts the API on a free port with its caches and the template fast path
+    disabled, so every request runs the full pipeline (unless --warm-cache);
+    returns (process, base URL).
+    """
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    env = {**os.environ, 'AI_PORT': str(port)}
+    if not args.warm_cache:
+        # The dataset fakes are in the template index and would skip OCR and features.
+        env.update(PRAMAAN_VERDICT_CACHE_SIZE='0', PRAMAAN_VERDICT_CACHE_DB='', PRAMAAN_OCR_CACHE_SIZE='0', PRAMAAN_TEMPLATE_MATCHING='0')
+    cmd = [sys.executable, 'app_rl.py']
+    if args.server == 'gunicorn':
+        cmd = ['gunicorn', '-c', 'gunicorn.conf.py', 'app_rl:app']
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 120
+    while time.time() < deadline and proc.poll() is None:
+        try:
+            with urllib.request.urlopen(f'{url}/ai/health/ready', timeout=2):
+                return proc, url
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.5)
+    proc.terminate()
+    raise RuntimeError("The API did not become ready (is a trained model present?).")
+
+def run_load(url: str, items: list, concurrency: int, duration: float) -> dict:
+    """
+    `concurrency` clients each send one request at a time, back to back, for
+    `duration` seconds. Throughput and latency percentiles cover successful
+    (2xx) responses only, so fast failures cannot make a level look better;
+    failed requests are reported as `errors` and `errorRate`.
+    """
+    latencies, errors, lock = [], [0], threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def client(offset: int):
+        i = offset
+        while time.perf_counter() < stop_at:
+            body, content_type = multipart(*items[i % len(items)])
+            i += 1
+            req = urllib.request.Request(f'{url}/ai/check', data=body, headers={'Content-Type': content_type})
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(req, timeout=120) as resp:
+                    resp.read()
+                    ok = 200 <= resp.status < 300
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors[0] += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(c,)) for c in range(concurrency)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    wall = time.perf_counter() - started
+    lat = np.array(latencies) * 1000.0
+    total = len(lat) + errors[0]
+    return {
+        'requests': len(lat),
+        'errors': errors[0],
+        'errorRate': errors[0] / total if total else 1.0,
+        'requestsPerSec': len(lat) / wall,
+        'p50Ms': float(np.percentile(lat, 50)) if len(lat) else None,
+        'p95Ms': float(np.percentile(lat, 95)) if len(lat) else None,
+        'p99Ms': float(np.percentile(lat, 99)) if len(lat) else None,
+    }
+
+def bench_load(args) -> dict:
+    items = dataset_images(args.limit) or [('scan.jpg', encode_jpeg(synthetic_scan(2)))]
+    proc = None
+    try:
+        url = args.url
+        if url is None:
+            proc, url = start_server(args)
+        results = {}
+        for c in args.concurrency:
+            results[f'c{c}'] = run_load(url, items, c, args.duration)
+            r = results[f'c{c}']
+            flag = '  ERRORS DOMINATE' if r['errorRate'] > args.max_error_rate else ''
+            print(f"concurrency {c:3d}: {r['requestsPerSec']:7.1f} req/s  p50 {r['p50Ms'] or 0:7.1f} ms  p95 {r['p95Ms'] or 0:7.1f} ms  "
+                  f"p99 {r['p99Ms'] or 0:7.1f} ms  errors {r['errors']} ({r['errorRate']:.0%}){flag}")
+        return results
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+# -----------------------------------------------------------------------------
+# Baseline Comparison
+# -----------------------------------------------------------------------------
+# Metric -> True when higher is better.
+COMPARED = {'callsPerSec': True, 'requestsPerSec': True, 'peakMiB': False, 'p95Ms': False}
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list:
+    """Human-readable regressions beyond `tolerance` (a fraction) for every metric present in both runs."""
+    regressions = []
+    for section in ('functions', 'load'):
+        for name, now in current.get(section, {}).items():
+            before = baseline.get(section, {}).get(name)
+            if not before: continue
+            for metric, higher_is_better in COMPARED.items():
+                if not now.get(metric) or not before.get(metric): continue
+                ratio = now[metric] / before[metric]
+                worse = ratio < 1 - tolerance if higher_is_better else ratio > 1 + tolerance
+                print(f"{section}/{name} {metric}: {before[metric]:.3f} -> {now[metric]:.3f} ({ratio:.2f}x){'  REGRESSION' if worse else ''}")
+                if worse:
+                    regressions.append(f'{section}/{name} {metric}')
+    return regressions
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'commit': commit, 'python': platform.python_version(),
+            'platform': platform.platform(), 'cpus': os.cpu_count(), 'numpy': np.__version__, 'opencv': cv2.__version__}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Pramaan AI detector.")
+    parser.add_argument('--output', default='benchmark.json', help="Where to write the JSON results.")
+    parser.add_argument('--baseline', help="A previous results file to compare against.")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="Allowed relative slowdown before a metric counts as a regression.")
+    parser.add_argument('--limit', type=int, default=20, help="Dataset images to use.")
+    parser.add_argument('--sizes', type=float, nargs='+', default=[4, 12], help="Synthetic scan sizes in megapixels.")
+    parser.add_argument('--pdf-pages', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--duration', type=float, default=15.0, help="Seconds per concurrency level.")
+    parser.add_argument('--server', choices=['dev', 'gunicorn'], default='dev', help="How to start the API for the load test.")
+    parser.add_argument('--url', help="Load-test an already running API instead of starting one.")
+    parser.add_argument('--max-error-rate', type=float, default=0.5, help="Fail when more than this fraction of a load-test level's requests fail.")
+    parser.add_argument('--warm-cache', action='store_true', help="Keep the verdict and OCR caches and template matching enabled during the load test.")
+    parser.add_argument('--skip-load', action='store_true')
+    args = parser.parse_args()
+
+    results = {'environment': environment(), 'functions': bench_functions(args)}
+    for name, r in results['functions'].items():
+        print(f"{name:45s} {r['msPerCall']:9.2f} ms/call {r['callsPerSec']:9.1f} calls/s {r['peakMiB']:8.1f} MiB peak")
+    if not args.skip_load:
+        try:
+            results['load'] = bench_load(args)
+        except RuntimeError as e:
+            print(f"Skipping load test: {e}")
+
+    with open(args.output, 'w') as fh:
+        json.dump(results, fh, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    failed = False
+    if args.baseline:
+        with open(args.baseline) as fh:
+            regressions = compare(results, json.load(fh), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}.")
+            failed = True
+    # Mostly failing requests measure the error path, not the detector.
+    erroring = [name for name, r in results.get('load', {}).items() if r['errorRate'] > args.max_error_rate]
+    if erroring:
+        print(f"\nMore than {args.max_error_rate:.0%} of requests failed at: {', '.join(erroring)}.")
+        failed = True
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# -----------------------------------------------------------------------------
+# Pramaan Feedback Log
+#
+# Adjudicated verdicts (a reviewer's final real/fake label for a document the
+# service has seen) are appended to a compact binary log as fixed-size
+# records: content SHA-256, label, timestamp and the feature vector the
+# service extracted. The trainer adds them to the dataset without touching
+# the original files again.
+#
+# Each record is written with one O_APPEND write, so every worker process on
+# the box can append to the same file without locking. Records are only valid
+# for the feature schema that produced them, so each schema version gets its
+# own file.
+# -----------------------------------------------------------------------------
+
+import numpy as np
+import os
+import threading
+import time
+from pramaan_features import FEATURE_SCHEMA_VERSION, NUM_FEATURES
+
+# --- Configuration ---
+FEEDBACK_DIR = os.environ.get('PRAMAAN_FEEDBACK_DIR', 'dataset')
+FEEDBACK_LOG_PATH = os.path.join(FEEDBACK_DIR, f'feedback.v{FEATURE_SCHEMA_VERSION}.log')
+
+RECORD_DTYPE = np.dtype([
+    ('digest', 'S32'),              # Raw SHA-256 of the document.
+    ('label', 'u1'),                # 0 = real, 1 = fake.
+    ('time', '<f8'),                # Unix time of the adjudication.
+    ('features', '<f4', (NUM_FEATURES,)),
+])
+
+LABELS = {'real': 0, 'fake': 1}
+
+def parse_label(value):
+    """0 or 1 from 'real'/'fake'/0/1 (case-insensitive), or None if unrecognized."""
+    text = str(value).strip().lower()
+    if text in LABELS: return LABELS[text]
+    if text in ('0', '1'): return int(text)
+    return None
+
+class FeedbackLog:
+    """Append-only log of (sha256, label, features) records."""
+
+    def __init__(self, path: str = FEEDBACK_LOG_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.appended = 0
+
+    def append(self, sha256: str, features: np.ndarray, label: int):
+        record = np.zeros(1, dtype=RECORD_DTYPE)
+        record['digest'] = bytes.fromhex(sha256)
+        record['label'] = label
+        record['time'] = time.time()
+        record['features'] = np.asarray(features, dtype=np.float32).reshape(NUM_FEATURES)
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, record.tobytes())
+        finally:
+            os.close(fd)
+        with self._lock:
+            self.appended += 1
+
+    def records(self) -> np.ndarray:
+        """Every complete record in append order (a torn trailing record from a crash is ignored)."""
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        return np.fromfile(self.path, dtype=RECORD_DTYPE, count=size // RECORD_DTYPE.itemsize)
+
+    def load(self):
+        """
+        Returns (digests, X, y) with one row per document: a later
+        adjudication of the same document replaces an earlier one.
+        """
+        records = self.records()
+        # np.unique keeps the first occurrence, so search the reversed log.
+        _, last = np.unique(records['digest'][::-1], return_index=True)
+        latest = np.sort(len(records) - 1 - last)
+        records = records[latest]
+        return records['digest'], records['features'].astype(np.float32), records['label'].astype(int)
+
+    def stats(self) -> dict:
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            size = 0
+        return {'path': self.path, 'records': size // RECORD_DTYPE.itemsize, 'appendedByThisWorker': self.appended}
@@ -0,0 +1,73 @@
+# -----------------------------------------------------------------------------
+# Pramaan AI Detector - Production Server
+#
+#   cd ai && gunicorn -c gunicorn.conf.py app_rl:app
+#
+# Pre-fork: the master imports app_rl once (loading the model and scaler) and
+# forks PRAMAAN_WORKERS workers that share those pages copy-on-write. Each
+# worker is limited to PRAMAAN_THREADS_PER_WORKER OpenCV/BLAS/OpenMP threads,
+# so workers x threads never oversubscribes the cores.
+#
+# Workers are gthread workers: requests run on a request thread while the
+# worker's main thread keeps heartbeating, so `timeout` catches a hung worker
+# rather than killing a long batch stream or a many-page PDF. A worker that is
+# recycled or stopped finishes its queued async jobs first (worker_exit), and
+# async job records are shared between the workers through PRAMAAN_JOB_DB.
+# -----------------------------------------------------------------------------
+
+import gc
+import os
+import tempfile
+
+cores = os.cpu_count() or 1
+threads_per_worker = max(1, int(os.environ.get('PRAMAAN_THREADS_PER_WORKER', '1')))
+
+# Native thread pools size themselves when their library loads, so these must
+# be set before app_rl (and with it numpy and cv2) is imported.
+for var in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'OMP_THREAD_LIMIT'):
+    os.environ.setdefault(var, str(threads_per_worker))
+# Each worker screens batch files on its own share of the cores.
+workers = int(os.environ.get('PRAMAAN_WORKERS', max(1, cores // threads_per_worker)))
+os.environ.setdefault('PRAMAAN_BATCH_WORKERS', str(max(1, cores // workers)))
+
+chdir = os.path.dirname(os.path.abspath(__file__))
+port = os.environ.get('AI_PORT', '5011')
+bind = f"0.0.0.0:{port}"
+# An async job is polled on whichever worker takes the request, so with more
+# than one worker the job records must be shared through a SQLite file (in
+# the same place app_rl spills PDFs unless PRAMAAN_JOB_DB says otherwise).
+if workers > 1:
+    spill_dir = os.environ.get('PRAMAAN_SPILL_DIR') or ('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir())
+    os.environ.setdefault('PRAMAAN_JOB_DB', os.path.join(spill_dir, f'pramaan-jobs-{port}.sqlite3'))
+preload_app = True
+worker_class = 'gthread'
+# One request at a time per worker by default: each request already uses
+# the worker's share of the cores.
+threads = max(1, int(os.environ.get('PRAMAAN_REQUEST_THREADS', '1')))
+# Seconds without a heartbeat from the worker's main thread, not per request.
+timeout = int(os.environ.get('PRAMAAN_WORKER_TIMEOUT', '120'))
+graceful_timeout = int(os.environ.get('PRAMAAN_GRACEFUL_TIMEOUT', '60'))
+# Async jobs still queued in a stopping worker get this long to finish
+# (within graceful_timeout, after which the master kills the worker).
+job_drain_seconds = max(0, graceful_timeout - 5)
+keepalive = 5
+# Recycle workers now and then to bound fragmentation from large images.
+max_requests = int(os.environ.get('PRAMAAN_MAX_REQUESTS', '2000'))
+max_requests_jitter = max_requests // 10
+
+def when_ready(server):
+    # Everything allocated by the preloaded app stays put, so the garbage
+    # collector does not touch (and un-share) those pages in the workers.
+    gc.freeze()
+
+def post_fork(server, worker):
+    import cv2
+    cv2.setNumThreads(threads_per_worker)
+
+def worker_exit(server, worker):
+    # Async jobs live on daemon threads of this worker; without this, a
+    # recycled worker (max_requests) would silently drop its queue.
+    from app_rl import job_queue
+    abandoned = job_queue.drain(job_drain_seconds)
+    if abandoned:
+        server.log.warning(f"Worker {worker.pid} exited with {abandoned} unfinished async jobs, recorded as failed.")
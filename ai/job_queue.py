@@ -0,0 +1,253 @@
+# -----------------------------------------------------------------------------
+# Pramaan Job Queue
+#
+# Asynchronous verification: a submitted document gets a job id immediately,
+# waits in a bounded in-process queue and is processed by a small pool of
+# worker threads. Results are fetched by polling or POSTed to a callback URL.
+# When the queue is full, submit() refuses the job instead of letting
+# requests pile up, and retry_after() estimates when to come back.
+#
+# Job records live in memory and, optionally, in a local SQLite file, so that
+# any worker process on the box can answer a poll.
+#
+# Callback URLs come from clients, so they are checked before the job is
+# accepted and again before the POST: the host must resolve to public
+# addresses only (or be in the configured allowlist), and redirects are not
+# followed.
+# -----------------------------------------------------------------------------
+
+import ipaddress
+import json
+import math
+import os
+import queue
+import socket
+import sqlite3
+import threading
+import time
+import urllib.request
+import uuid
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+class QueueFullError(Exception):
+    """Raised by JobQueue.submit when the queue is at capacity."""
+
+def callback_url_error(url: str, allowed_hosts: tuple = ()):
+    """
+    Why `url` may not be used as a callback, or None. It must be http(s). With
+    `allowed_hosts`, its host must be one of them (an entry starting with '.'
+    also allows subdomains) and is then trusted as is; otherwise every address
+    the host resolves to must be public, so that a client cannot make the
+    service POST to loopback, link-local (cloud metadata) or private networks.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        return 'callbackUrl must be an http(s) URL.'
+    host = parsed.hostname.lower().rstrip('.')
+    if allowed_hosts:
+        if any(host == h or (h.startswith('.') and host.endswith(h)) for h in allowed_hosts):
+            return None
+        return f'callbackUrl host {host} is not allowed.'
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, parsed.port or None, proto=socket.IPPROTO_TCP)}
+    except (OSError, ValueError) as e:
+        return f'callbackUrl host {host} cannot be resolved: {e}'
+    for address in addresses:
+        if not ipaddress.ip_address(address.split('%')[0]).is_global:
+            return f'callbackUrl host {host} resolves to a non-public address.'
+    return None
+
+class _NoRedirects(urllib.request.HTTPRedirectHandler):
+    """A redirect could point the callback at an internal address; report the 3xx instead."""
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+_callback_opener = urllib.request.build_opener(_NoRedirects)
+
+class JobQueue:
+    """
+    Bounded queue of verification jobs. `handler(payload, timings)` runs in a
+    worker thread and returns (body, status); it may add per-stage
+    milliseconds to `timings`.
+    """
+
+    # Finished jobs are purged from SQLite once every this many writes.
+    PURGE_EVERY = 256
+
+    def __init__(self, handler, workers: int = 2, max_pending: int = 64, ttl_seconds: float = 3600.0,
+                 db_path: str = None, callback_timeout: float = 10.0, callback_hosts: tuple = ()):
+        self.handler = handler
+        self.workers = workers
+        self.max_pending = max_pending
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self.callback_timeout = callback_timeout
+        self.callback_hosts = tuple(h.strip().lower() for h in callback_hosts if h.strip())
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._writes = 0
+        # Exponentially weighted mean job duration, for Retry-After.
+        self._mean_seconds = 1.0
+        self.completed = self.failed = self.rejected = 0
+        self._db = None
+        self._db_pid = None
+
+    def _connection(self):
+        """The SQLite connection of this process, opened on first use (see VerdictCache)."""
+        if self.db_path and self._db_pid != os.getpid():
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, updated REAL, finished INTEGER, job TEXT)")
+            self._db_pid = os.getpid()
+        return self._db
+
+    def _start(self):
+        # Workers start with the first job, so a pre-fork master never owns them.
+        if len(self._threads) < self.workers:
+            for i in range(len(self._threads), self.workers):
+                thread = threading.Thread(target=self._work, name=f'pramaan-job-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def callback_error(self, url: str):
+        """Why `url` may not be used as this queue's callback, or None (see callback_url_error)."""
+        return callback_url_error(url, self.callback_hosts)
+
+    def submit(self, payload: dict, callback_url: str = None) -> dict:
+        """
+        Queues a job and returns its record. Raises QueueFullError when the
+        queue is full; the caller checks callback_url with callback_error().
+        """
+        job = {'jobId': uuid.uuid4().hex, 'status': 'queued', 'submitted': time.time(), 'timings': {}}
+        if callback_url:
+            job['callbackUrl'] = callback_url
+        with self._lock:
+            self._start()
+            try:
+                self._queue.put_nowait((job, payload))
+            except queue.Full:
+                self.rejected += 1
+                raise QueueFullError(f'The job queue is full ({self.max_pending} pending).')
+            self._save(job)
+        return {**job, 'timings': {}}
+
+    def get(self, job_id: str):
+        """The job's current record, or None if it is unknown or expired."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return {**job, 'timings': dict(job['timings'])}
+            db = self._connection()
+            if db is not None:
+                row = db.execute("SELECT job FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+                if row:
+                    return json.loads(row[0])
+            return None
+
+    def retry_after(self) -> int:
+        """Seconds until the queue has likely drained enough to accept another job."""
+        return max(1, math.ceil(self._queue.qsize() * self._mean_seconds / max(1, self.workers)))
+
+    def _save(self, job: dict):
+        now = time.time()
+        self._jobs[job['jobId']] = job
+        self._jobs.move_to_end(job['jobId'])
+        # Finished jobs expire after the TTL; unfinished ones are still in the queue.
+        while self._jobs:
+            oldest = next(iter(self._jobs.values()))
+            if oldest['status'] not in ('done', 'failed') or now - oldest['finished'] <= self.ttl_seconds:
+                break
+            self._jobs.popitem(last=False)
+        db = self._connection()
+        if db is not None:
+            db.execute("INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?)",
+                       (job['jobId'], now, job['status'] in ('done', 'failed'), json.dumps(job)))
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                db.execute("DELETE FROM jobs WHERE finished AND updated < ?", (now - self.ttl_seconds,))
+
+    def _work(self):
+        while True:
+            job, payload = self._queue.get()
+            started = time.time()
+            with self._lock:
+                job['status'] = 'running'
+                job['timings']['queuedMs'] = 1000.0 * (started - job['submitted'])
+                self._save(job)
+            timings = {}
+            try:
+                body, code = self.handler(payload, timings)
+            except Exception as e:
+                body, code = {'error': f'An unexpected error occurred: {str(e)}'}, 500
+            finished = time.time()
+            with self._lock:
+                job.update(status='done' if code < 400 else 'failed', code=code, result=body, finished=finished)
+                job['timings'].update(timings, totalMs=1000.0 * (finished - job['submitted']))
+                self._mean_seconds = 0.8 * self._mean_seconds + 0.2 * (finished - started)
+                self.completed += code < 400
+                self.failed += code >= 400
+                self._save(job)
+            if 'callbackUrl' in job:
+                self._callback(job)
+            self._queue.task_done()
+
+    def _callback(self, job: dict):
+        """POSTs the finished job record to its callback URL; failures are recorded on the job."""
+        record = {k: v for k, v in job.items() if k != 'callbackUrl'}
+        req = urllib.request.Request(job['callbackUrl'], data=json.dumps(record).encode(),
+                                     headers={'Content-Type': 'application/json'}, method='POST')
+        # Checked again: the host may resolve differently by now.
+        status = self.callback_error(job['callbackUrl'])
+        if status is None:
+            try:
+                with _callback_opener.open(req, timeout=self.callback_timeout) as resp:
+                    status = resp.status
+            except Exception as e:
+                status = str(e)
+        with self._lock:
+            job['callbackStatus'] = status
+            self._save(job)
+
+    def drain(self, timeout: float) -> int:
+        """
+        Called when the process is about to exit: waits up to `timeout` seconds
+        for the queued and running jobs to finish, then records the rest as
+        failed (503, 'submit again') so that a poll does not report them as
+        queued forever. Returns the number of jobs given up on.
+        """
+        deadline = time.time() + timeout
+        while self._queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.05)
+        abandoned = 0
+        with self._lock:
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                self._queue.task_done()
+            now = time.time()
+            for job in list(self._jobs.values()):
+                if job['status'] in ('queued', 'running'):
+                    job.update(status='failed', code=503, finished=now,
+                               result={'error': 'The server restarted before this job finished; submit the document again.'})
+                    self.failed += 1
+                    abandoned += 1
+                    self._save(job)
+        return abandoned
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'pending': self._queue.qsize(),
+                'maxPending': self.max_pending,
+                'workers': self.workers,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'meanJobMs': 1000.0 * self._mean_seconds,
+                'persistent': bool(self.db_path),
+            }
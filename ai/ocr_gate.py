@@ -0,0 +1,185 @@
+# -----------------------------------------------------------------------------
+# Pramaan Certificate Gate (tiered OCR)
+#
+# Decides whether a document looks like a certificate before any forensic
+# work runs. OCR is by far the most expensive step, so it is tiered:
+#
+#   1. title  - a downscaled OCR of the bands where certificate titles sit,
+#               stopping at the first band that contains a keyword;
+#   2. full   - the original full-page pass, only when tier 1 found nothing.
+#
+# Results are cached by content hash. A failure of the OCR engine itself is
+# raised as OCRError rather than reported as a rejection, and never cached.
+#
+# With `tesserocr` (in requirements.txt on Linux), OCR runs on a pool of
+# persistent Tesseract engines. The engines are created on first use, so a
+# pre-fork server builds them in each worker rather than in the master.
+# Without it, every OCR call starts a `tesseract` process. Process startup
+# then dominates, so the title bands are read in one call rather than one
+# call per band.
+# -----------------------------------------------------------------------------
+
+import cv2
+import importlib.util
+import numpy as np
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from PIL import Image
+import pytesseract
+
+# Without it (or if its engines cannot be created), OCR falls back to a pytesseract subprocess per call.
+HAS_TESSEROCR = importlib.util.find_spec('tesserocr') is not None
+
+KEYWORDS = ['certificate', 'completion', 'award', 'certify', 'diploma', 'training', 'course', 'successfully completed']
+KEYWORD_PATTERN = re.compile('|'.join(re.escape(k) for k in KEYWORDS))
+
+# Horizontal bands (fractions of the page height) OCR'd by tier 1, in order.
+TITLE_BANDS = ((0.0, 0.4), (0.3, 0.7))
+# Tier 1 works on bands downscaled to at most this width.
+TITLE_MAX_WIDTH = 1200
+
+FOUND_MESSAGE = "Certificate keywords found."
+NOT_FOUND_MESSAGE = "Content Analysis Failed: The document does not contain certificate-related keywords."
+
+class OCRError(RuntimeError):
+    """The OCR engine failed (not installed, timed out, crashed); says nothing about the document."""
+
+def has_certificate_keywords(text: str) -> bool:
+    return KEYWORD_PATTERN.search(text.lower()) is not None
+
+def binarize(image: np.ndarray) -> np.ndarray:
+    """The gate's OCR preprocessing: grayscale plus adaptive threshold."""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
+
+class TesseractPool:
+    """A fixed pool of persistent tesserocr engines; each is used by one thread at a time."""
+
+    def __init__(self, size: int, lang: str = 'eng'):
+        import tesserocr
+        self._engines = queue.Queue()
+        for _ in range(size):
+            self._engines.put(tesserocr.PyTessBaseAPI(lang=lang))
+
+    def image_to_string(self, image: np.ndarray, timeout: float) -> str:
+        """OCRs one image; raises RuntimeError if recognition does not finish within `timeout` seconds."""
+        engine = self._engines.get()
+        try:
+            engine.SetImage(Image.fromarray(image))
+            if not engine.Recognize(timeout=int(timeout * 1000)):
+                raise RuntimeError(f"Tesseract did not finish within {timeout:g} s.")
+            return engine.GetUTF8Text()
+        finally:
+            self._engines.put(engine)
+
+class CertificateGate:
+    """Tiered, cached keyword OCR. check() returns (is_certificate, message) or raises OCRError."""
+
+    TIERS = ('cache', 'title', 'full')
+
+    def __init__(self, cache_size: int = 4096, pool_size: int = 0, title_timeout: float = 5, full_timeout: float = 10):
+        self.title_timeout = title_timeout
+        self.full_timeout = full_timeout
+        self.pool_size = pool_size if HAS_TESSEROCR else 0
+        self._pool = None
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+        self._stats = {tier: {'calls': 0, 'hits': 0, 'seconds': 0.0} for tier in self.TIERS}
+
+    def _engines(self):
+        """The TesseractPool, created on first use; None when OCR uses subprocesses."""
+        if self._pool is None and self.pool_size > 0:
+            with self._lock:
+                if self._pool is None and self.pool_size > 0:
+                    try:
+                        self._pool = TesseractPool(self.pool_size)
+                    except Exception as e:
+                        # E.g. the bundled library cannot find tessdata (set TESSDATA_PREFIX).
+                        print(f"Could not start persistent Tesseract engines, using subprocesses: {e}")
+                        self.pool_size = 0
+        return self._pool
+
+    def _ocr(self, image: np.ndarray, timeout: float) -> str:
+        pool = self._engines()
+        if pool is not None:
+            return pool.image_to_string(image, timeout)
+        return pytesseract.image_to_string(image, timeout=timeout)
+
+    def _record(self, tier: str, started: float, hit: bool):
+        with self._lock:
+            stats = self._stats[tier]
+            stats['calls'] += 1
+            stats['hits'] += hit
+            stats['seconds'] += time.perf_counter() - started
+
+    def _title_tier(self, image: np.ndarray) -> bool:
+        """Tier 1: OCR the title bands at reduced resolution; stops at the first keyword."""
+        h, w = image.shape[:2]
+        scale = min(1.0, TITLE_MAX_WIDTH / w)
+        # A subprocess costs more to start than the extra rows cost to read.
+        bands = TITLE_BANDS if self._engines() is not None else ((TITLE_BANDS[0][0], TITLE_BANDS[-1][1]),)
+        for top, bottom in bands:
+            band = image[int(h * top):int(h * bottom)]
+            if scale < 1.0:
+                band = cv2.resize(band, (int(w * scale), max(1, int(band.shape[0] * scale))), interpolation=cv2.INTER_AREA)
+            if has_certificate_keywords(self._ocr(binarize(band), self.title_timeout)):
+                return True
+        return False
+
+    def _full_tier(self, image: np.ndarray) -> bool:
+        """Tier 2: the full-page pass at analysis resolution."""
+        return has_certificate_keywords(self._ocr(binarize(image), self.full_timeout))
+
+    def check(self, image: np.ndarray, cache_key: str = None) -> tuple[bool, str]:
+        """
+        Uses tiered OCR with preprocessing to check for certificate keywords.
+        Raises OCRError when OCR itself fails, so that the caller can report
+        it as transient instead of as a verdict on the document.
+        """
+        started = time.perf_counter()
+        if cache_key is not None:
+            with self._lock:
+                cached = self._cache.get(cache_key)
+                if cached is not None: self._cache.move_to_end(cache_key)
+            self._record('cache', started, cached is not None)
+            if cached is not None:
+                return cached
+        try:
+            if image is None: return False, "Invalid image format."
+            started = time.perf_counter()
+            found = self._title_tier(image)
+            self._record('title', started, found)
+            if not found:
+                started = time.perf_counter()
+                found = self._full_tier(image)
+                self._record('full', started, found)
+            result = (True, FOUND_MESSAGE) if found else (False, NOT_FOUND_MESSAGE)
+        except pytesseract.TesseractNotFoundError:
+            raise OCRError("OCR Error: Tesseract is not installed or configured correctly.")
+        except Exception as e:
+            raise OCRError(f"An unexpected OCR error occurred: {str(e)}") from e
+
+        if cache_key is not None:
+            with self._lock:
+                self._cache[cache_key] = result
+                while len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+        return result
+
+    def stats(self) -> dict:
+        """Per-tier call counts, hit rates (keyword found / cache hit) and mean latency."""
+        with self._lock:
+            report = {}
+            for tier, s in self._stats.items():
+                report[tier] = {
+                    'calls': s['calls'],
+                    'hits': s['hits'],
+                    'hitRate': s['hits'] / s['calls'] if s['calls'] else 0.0,
+                    'meanMs': 1000.0 * s['seconds'] / s['calls'] if s['calls'] else 0.0,
+                }
+            report['persistentEngines'] = self.pool_size > 0
+            return report
@@ -0,0 +1,140 @@
+# -----------------------------------------------------------------------------
+# Pramaan PDF Pages
+#
+# Rasterizes PDF pages for analysis. Pages are rendered straight into memory
+# by concurrent pdftoppm processes (pdf2image's thread_count), a few pages at
+# a time so a long PDF never holds every page at once, and the next chunk is
+# rendered while the current one is being analyzed. The embedded text layer
+# is read with pdftotext, so text PDFs can skip OCR entirely.
+#
+# Page sizes are read with pdfinfo before rendering: a page that would exceed
+# the analysis budget at PDF_DPI is rendered at a lower DPI instead, and one
+# that would exceed MAX_DECODE_PIXELS is refused, as for images.
+# -----------------------------------------------------------------------------
+
+import os
+import re
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pramaan_features import MAX_ANALYSIS_PIXELS, MAX_DECODE_PIXELS, ImageTooLargeError, from_pil
+
+# --- Configuration ---
+# 200 DPI is poppler's default and what the model has always been trained on.
+PDF_DPI = int(os.environ.get('PRAMAAN_PDF_DPI', '200'))
+# Pages to analyze: 'all' or a list such as '1-3,5'; capped at PDF_MAX_PAGES.
+PDF_PAGES = os.environ.get('PRAMAAN_PDF_PAGES', 'all')
+PDF_MAX_PAGES = int(os.environ.get('PRAMAAN_PDF_MAX_PAGES', '20'))
+# pdftoppm processes per chunk, and pages rendered per chunk.
+PDF_THREADS = int(os.environ.get('PRAMAAN_PDF_THREADS', '4'))
+PDF_CHUNK_PAGES = int(os.environ.get('PRAMAAN_PDF_CHUNK_PAGES', '4'))
+# A page whose text layer has fewer characters than this is treated as a scan.
+MIN_TEXT_LAYER_CHARS = 20
+
+def _poppler(poppler_path: str):
+    """The configured poppler directory if it exists here, else None (use PATH)."""
+    return poppler_path if poppler_path and os.path.isdir(poppler_path) else None
+
+def page_count(pdf_path: str, poppler_path: str = None) -> int:
+    from pdf2image import pdfinfo_from_path
+    return int(pdfinfo_from_path(pdf_path, poppler_path=_poppler(poppler_path))['Pages'])
+
+def select_pages(count: int, spec: str = None, max_pages: int = None) -> list:
+    """1-based page numbers chosen by a spec like 'all' or '1-3,5', within the document and the cap."""
+    spec = (spec or PDF_PAGES).strip().lower()
+    max_pages = max_pages or PDF_MAX_PAGES
+    if spec == 'all':
+        pages = range(1, count + 1)
+    else:
+        pages = set()
+        for part in spec.split(','):
+            first, _, last = part.strip().partition('-')
+            pages.update(range(int(first), int(last or first) + 1))
+    return sorted(p for p in pages if 1 <= p <= count)[:max_pages]
+
+def text_layer(pdf_path: str, pages: list, poppler_path: str = None) -> dict:
+    """{page: text} from the PDF's embedded text layer; empty if there is none or pdftotext fails."""
+    if not pages: return {}
+    exe = os.path.join(_poppler(poppler_path), 'pdftotext') if _poppler(poppler_path) else 'pdftotext'
+    first, last = min(pages), max(pages)
+    try:
+        out = subprocess.run([exe, '-f', str(first), '-l', str(last), '-enc', 'UTF-8', pdf_path, '-'],
+                             capture_output=True, timeout=30, check=True).stdout.decode('utf-8', 'replace')
+    except (OSError, subprocess.SubprocessError):
+        return {}
+    # pdftotext ends every page with a form feed.
+    texts = dict(zip(range(first, last + 1), out.split('\f')))
+    return {p: texts.get(p, '') for p in pages}
+
+def has_text_layer(text: str) -> bool:
+    return len(''.join(text.split())) >= MIN_TEXT_LAYER_CHARS
+
+_PAGE_SIZE = re.compile(r'Page\s+(\d+) size')
+
+def page_dpis(pdf_path: str, first: int, last: int, poppler_path: str, dpi: int) -> dict:
+    """
+    {page: DPI to render it at}: `dpi`, lowered for pages that would hold more
+    than MAX_ANALYSIS_PIXELS at it. Raises ImageTooLargeError for a page that
+    would hold more than MAX_DECODE_PIXELS at `dpi`, and ValueError for one
+    whose size pdfinfo does not report.
+    """
+    from pdf2image import pdfinfo_from_path
+    info = pdfinfo_from_path(pdf_path, poppler_path=_poppler(poppler_path), first_page=first, last_page=last)
+    sizes = {}
+    for key, value in info.items():
+        match = _PAGE_SIZE.fullmatch(key)
+        if match:
+            width, _, height = value.split()[:3]
+            sizes[int(match.group(1))] = float(width) * float(height) / (72.0 * 72.0)
+    dpis = {}
+    for page in range(first, last + 1):
+        if page not in sizes:
+            raise ValueError(f"pdfinfo did not report the size of page {page}.")
+        pixels = sizes[page] * dpi * dpi
+        if pixels > MAX_DECODE_PIXELS:
+            raise ImageTooLargeError(f"PDF page {page} is {pixels / 1e6:.0f} MP at {dpi} DPI; the limit is {MAX_DECODE_PIXELS} pixels.")
+        dpis[page] = dpi if pixels <= MAX_ANALYSIS_PIXELS else max(1, int(dpi * (MAX_ANALYSIS_PIXELS / pixels) ** 0.5))
+    return dpis
+
+def _render(pdf_path: str, first: int, last: int, poppler_path: str, dpi: int, thread_count: int) -> list:
+    from pdf2image import convert_from_path
+    dpis = page_dpis(pdf_path, first, last, poppler_path, dpi)
+    if all(d == dpi for d in dpis.values()):
+        runs = [(first, last, dpi)]
+    else:
+        # Oversized pages are rare; they are rendered one by one at their own DPI.
+        runs = [(p, p, d) for p, d in dpis.items()]
+    rendered = []
+    for run_first, run_last, run_dpi in runs:
+        images = convert_from_path(pdf_path, dpi=run_dpi, first_page=run_first, last_page=run_last,
+                                   thread_count=max(1, min(thread_count, run_last - run_first + 1)), poppler_path=_poppler(poppler_path))
+        rendered.extend((run_first + i, from_pil(img)) for i, img in enumerate(images))
+    return rendered
+
+def iter_pages(pdf_path: str, pages: list, poppler_path: str = None, dpi: int = None, thread_count: int = None, chunk_pages: int = None):
+    """
+    Yields (page, BGR array) for the given pages in order. At most two chunks
+    of PDF_CHUNK_PAGES pages are in memory: the one being consumed and the
+    one being rendered in the background. Raises ImageTooLargeError for a page
+    too large to render (see page_dpis).
+    """
+    dpi, thread_count, chunk_pages = dpi or PDF_DPI, thread_count or PDF_THREADS, chunk_pages or PDF_CHUNK_PAGES
+    # Consecutive pages are rendered together, chunk_pages at a time.
+    chunks, run = [], []
+    for p in sorted(pages):
+        if run and (p != run[-1] + 1 or len(run) == chunk_pages):
+            chunks.append((run[0], run[-1])); run = []
+        run.append(p)
+    if run: chunks.append((run[0], run[-1]))
+
+    with ThreadPoolExecutor(max_workers=1) as prefetch:
+        pending = prefetch.submit(_render, pdf_path, *chunks[0], poppler_path, dpi, thread_count) if chunks else None
+        for i in range(len(chunks)):
+            rendered = pending.result()
+            pending = prefetch.submit(_render, pdf_path, *chunks[i + 1], poppler_path, dpi, thread_count) if i + 1 < len(chunks) else None
+            yield from rendered
+            del rendered
+
+def render_page(pdf_path: str, page: int = 1, poppler_path: str = None, dpi: int = None):
+    """One page as a BGR array, or None if the PDF cannot be rendered. Raises ImageTooLargeError like iter_pages."""
+    rendered = _render(pdf_path, page, page, poppler_path, dpi or PDF_DPI, 1)
+    return rendered[0][1] if rendered else None
@@ -0,0 +1,274 @@
+# -----------------------------------------------------------------------------
+# Pramaan Template Index
+#
+# Perceptual hashes of the known real and fake certificates in 'dataset/',
+# for recognizing re-scans, re-screenshots and reused fake templates that an
+# exact SHA-256 match misses. Each document gets a 64-bit pHash (sign of the
+# low-frequency DCT coefficients against their median) and a 64-bit dHash
+# (horizontal gradient signs), both robust to rescaling and recompression.
+#
+# Lookup is multi-index hashing: the pHash is split into four 16-bit chunks,
+# and any hash within Hamming distance r of the query agrees with it to
+# within r // 4 bits on at least one chunk. Each chunk has a bucket table
+# over all 65536 values, so a query probes a few dozen buckets and checks the
+# full distance only for the entries found there.
+#
+# The index is one file of consecutive .npy arrays, memory-mapped read-only,
+# so every worker process shares the same pages. `python phash_index.py`
+# builds it, rehashing only files added or changed since the last build.
+# -----------------------------------------------------------------------------
+
+import numpy as np
+import os
+import argparse
+import functools
+import threading
+import cv2
+from pramaan_features import load_image
+from pramaan_dataset import FAKE_PATH, REAL_PATH, featurize_many, list_dataset_files, render_pdf_first_page
+
+# --- Configuration ---
+TEMPLATE_INDEX_PATH = os.environ.get('PRAMAAN_TEMPLATE_INDEX', os.path.join('dataset', 'templates.index'))
+# Maximum Hamming distances (of 64 bits) for a match; both must hold.
+TEMPLATE_RADIUS = int(os.environ.get('PRAMAAN_TEMPLATE_RADIUS', '6'))
+TEMPLATE_DHASH_RADIUS = int(os.environ.get('PRAMAAN_TEMPLATE_DHASH_RADIUS', '10'))
+# Bumped when the file layout or the hash functions change.
+INDEX_FORMAT_VERSION = 1
+
+CHUNKS = 4
+CHUNK_BITS = 16
+# Radii up to this probe at most two flipped bits per chunk (137 buckets).
+MAX_RADIUS = CHUNKS * 3 - 1
+
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def popcount64(x: np.ndarray) -> np.ndarray:
+    """Set bits of each uint64."""
+    x = np.ascontiguousarray(x, dtype=np.uint64)
+    return _POPCOUNT[x.view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.int64)
+
+@functools.lru_cache(maxsize=None)
+def _flip_masks(bits: int) -> np.ndarray:
+    """All 16-bit masks with at most `bits` bits set."""
+    masks = np.arange(1 << CHUNK_BITS, dtype=np.uint64)
+    return np.nonzero(popcount64(masks) <= bits)[0]
+
+# -----------------------------------------------------------------------------
+# Perceptual Hashes
+# -----------------------------------------------------------------------------
+def _pack(bits: np.ndarray) -> np.uint64:
+    return np.packbits(bits.ravel().astype(np.uint8)).view('>u8')[0].astype(np.uint64)
+
+def image_hashes(image: np.ndarray) -> tuple:
+    """(pHash, dHash) of a BGR or grayscale image as np.uint64."""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    # One pass over the full image; both hashes are taken from this thumbnail.
+    thumb = cv2.resize(gray, (64, 64), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(cv2.resize(thumb, (32, 32), interpolation=cv2.INTER_AREA))[:8, :8].ravel()
+    # The DC term only measures overall brightness, so it does not set the median.
+    phash = _pack(low > np.median(low[1:]))
+    strip = cv2.resize(thumb, (9, 8), interpolation=cv2.INTER_AREA)
+    dhash = _pack(strip[:, 1:] > strip[:, :-1])
+    return phash, dhash
+
+def hash_sample(filepath: str):
+    """(pHash, dHash) of one dataset file (PDFs by their first page), or None."""
+    try:
+        image = render_pdf_first_page(filepath) if filepath.lower().endswith('.pdf') else load_image(filepath)
+        return image_hashes(image) if image is not None else None
+    except Exception:
+        return None
+
+# -----------------------------------------------------------------------------
+# File Layout
+# -----------------------------------------------------------------------------
+_ALIGN = 64
+
+def _save_arrays(path: str, arrays: dict):
+    """Writes a names array, then each array, as 64-byte-aligned .npy records (atomically)."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as fh:
+        for array in [np.array(list(arrays), dtype=str)] + list(arrays.values()):
+            np.lib.format.write_array(fh, np.asarray(array), allow_pickle=False)
+            fh.write(b'\0' * (-fh.tell() % _ALIGN))
+    os.replace(tmp_path, path)
+
+def _map_arrays(path: str) -> dict:
+    """Reads the names array and memory-maps every array written by _save_arrays."""
+    readers = {(1, 0): np.lib.format.read_array_header_1_0, (2, 0): np.lib.format.read_array_header_2_0}
+    arrays = {}
+    with open(path, 'rb') as fh:
+        names = np.lib.format.read_array(fh, allow_pickle=False).tolist()
+        fh.seek(-fh.tell() % _ALIGN, os.SEEK_CUR)
+        for name in names:
+            shape, fortran, dtype = readers[np.lib.format.read_magic(fh)](fh)
+            offset = fh.tell()
+            count = int(np.prod(shape))
+            if count == 0 or shape == ():
+                arrays[name] = np.fromfile(fh, dtype=dtype, count=count).reshape(shape)
+            else:
+                arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape, order='F' if fortran else 'C')
+            fh.seek(offset + count * dtype.itemsize)
+            fh.seek(-fh.tell() % _ALIGN, os.SEEK_CUR)
+    return arrays
+
+def _chunk_tables(phash: np.ndarray) -> tuple:
+    """Per chunk: bucket offsets (CHUNKS, 65537) and entry ids sorted by chunk value (CHUNKS, N)."""
+    offsets = np.zeros((CHUNKS, (1 << CHUNK_BITS) + 1), dtype=np.uint32)
+    order = np.empty((CHUNKS, len(phash)), dtype=np.uint32)
+    for c in range(CHUNKS):
+        keys = ((phash >> np.uint64(CHUNK_BITS * c)) & np.uint64(0xFFFF)).astype(np.int64)
+        order[c] = np.argsort(keys, kind='stable')
+        offsets[c, 1:] = np.cumsum(np.bincount(keys, minlength=1 << CHUNK_BITS))
+    return offsets, order
+
+# -----------------------------------------------------------------------------
+# Build
+# -----------------------------------------------------------------------------
+def build_index(path: str = TEMPLATE_INDEX_PATH, workers=None) -> dict:
+    """
+    Indexes every file in dataset/real (label 0) and dataset/fake (label 1).
+    Hashes of files whose size and mtime are unchanged since the previous
+    build are reused; deleted files drop out. Returns build statistics.
+    """
+    previous = {}
+    if os.path.exists(path):
+        try:
+            old = _map_arrays(path)
+            if int(old['format_version']) == INDEX_FORMAT_VERSION:
+                previous = {p: (int(s), int(m), h, d) for p, s, m, h, d in
+                            zip(old['paths'].tolist(), old['sizes'], old['mtimes'], old['phash'], old['dhash'])}
+        except (OSError, KeyError, ValueError):
+            previous = {}
+
+    files = [(p, 0) for p in list_dataset_files(REAL_PATH)] + [(p, 1) for p in list_dataset_files(FAKE_PATH)]
+    entries, todo = {}, []
+    for p, label in files:
+        st = os.stat(p)
+        known = previous.get(p)
+        if known and known[:2] == (st.st_size, st.st_mtime_ns):
+            entries[p] = (label, st.st_size, st.st_mtime_ns, known[2], known[3])
+        else:
+            todo.append((p, label, st.st_size, st.st_mtime_ns))
+    if todo:
+        print(f"Hashing {len(todo)} new or changed files...")
+    skipped = 0
+    for (p, label, size, mtime), hashes in zip(todo, featurize_many([t[0] for t in todo], workers, fn=hash_sample)):
+        if hashes is None:
+            skipped += 1
+            continue
+        entries[p] = (label, size, mtime, *hashes)
+
+    paths = list(entries)
+    phash = np.array([entries[p][3] for p in paths], dtype=np.uint64)
+    offsets, order = _chunk_tables(phash)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    _save_arrays(path, {
+        'format_version': np.int64(INDEX_FORMAT_VERSION),
+        'phash': phash,
+        'dhash': np.array([entries[p][4] for p in paths], dtype=np.uint64),
+        'labels': np.array([entries[p][0] for p in paths], dtype=np.uint8),
+        'chunk_offsets': offsets,
+        'chunk_order': order,
+        'paths': np.array(paths, dtype=str),
+        'sizes': np.array([entries[p][1] for p in paths], dtype=np.int64),
+        'mtimes': np.array([entries[p][2] for p in paths], dtype=np.int64),
+    })
+    return {'entries': len(paths), 'hashed': len(todo) - skipped, 'reused': len(paths) - len(todo) + skipped, 'skipped': skipped}
+
+# -----------------------------------------------------------------------------
+# Lookup
+# -----------------------------------------------------------------------------
+class TemplateIndex:
+    """
+    Read-only view of the index file. refresh() maps a rebuilt file and
+    swaps it in; lookups already running keep the arrays they started with.
+    """
+
+    def __init__(self, path: str = TEMPLATE_INDEX_PATH, radius: int = TEMPLATE_RADIUS, dhash_radius: int = TEMPLATE_DHASH_RADIUS):
+        self.path = path
+        self.radius = min(radius, MAX_RADIUS)
+        self.dhash_radius = dhash_radius
+        self._arrays = None
+        self._stamp = None
+        self._lock = threading.Lock()
+        self.lookups = self.matches = 0
+        self.refresh()
+
+    def refresh(self) -> bool:
+        """Maps the index file if it changed since the last call. Returns True when a new index was swapped in."""
+        with self._lock:
+            try:
+                st = os.stat(self.path)
+                stamp = (st.st_size, st.st_mtime_ns)
+            except FileNotFoundError:
+                stamp = None
+            if stamp == self._stamp:
+                return False
+            self._stamp = stamp
+            if stamp is None:
+                self._arrays = None
+                return True
+            try:
+                arrays = _map_arrays(self.path)
+                if int(arrays['format_version']) != INDEX_FORMAT_VERSION:
+                    raise ValueError(f"format v{int(arrays['format_version'])} is not supported; rebuild it")
+            except (OSError, KeyError, ValueError) as e:
+                print(f"Template index {self.path} not loaded: {e}")
+                return False
+            self._arrays = arrays
+            return True
+
+    def __len__(self):
+        arrays = self._arrays
+        return 0 if arrays is None else len(arrays['phash'])
+
+    def lookup(self, phash: np.uint64, dhash: np.uint64) -> tuple:
+        """(labels, pHash distances) of the entries within both radii."""
+        arrays = self._arrays
+        if arrays is None or len(arrays['phash']) == 0:
+            return np.zeros(0, dtype=np.uint8), np.zeros(0, dtype=np.int64)
+        masks = _flip_masks(self.radius // CHUNKS)
+        offsets, order = arrays['chunk_offsets'], arrays['chunk_order']
+        found = []
+        for c in range(CHUNKS):
+            probes = masks ^ int((phash >> np.uint64(CHUNK_BITS * c)) & np.uint64(0xFFFF))
+            starts, ends = offsets[c, probes], offsets[c, probes + 1]
+            hit = ends > starts
+            found.extend(order[c, s:e] for s, e in zip(starts[hit], ends[hit]))
+        if not found:
+            return np.zeros(0, dtype=np.uint8), np.zeros(0, dtype=np.int64)
+        ids = np.unique(np.concatenate(found))
+        distance = popcount64(arrays['phash'][ids] ^ phash)
+        ok = (distance <= self.radius) & (popcount64(arrays['dhash'][ids] ^ dhash) <= self.dhash_radius)
+        return np.asarray(arrays['labels'][ids[ok]]), distance[ok]
+
+    def nearest(self, image: np.ndarray) -> dict:
+        """
+        {'real': distance or None, 'fake': distance or None}: the closest match
+        of each label. An undecodable image (None) matches nothing.
+        """
+        if image is None:
+            return {'real': None, 'fake': None}
+        labels, distance = self.lookup(*image_hashes(image))
+        result = {name: (int(distance[labels == label].min()) if (labels == label).any() else None)
+                  for name, label in (('real', 0), ('fake', 1))}
+        with self._lock:
+            self.lookups += 1
+            self.matches += bool(len(labels))
+        return result
+
+    def stats(self) -> dict:
+        arrays = self._arrays
+        labels = np.asarray(arrays['labels']) if arrays is not None else np.zeros(0, dtype=np.uint8)
+        return {'entries': len(labels), 'fakeEntries': int(labels.sum()), 'radius': self.radius,
+                'dhashRadius': self.dhash_radius, 'lookups': self.lookups, 'matches': self.matches}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build or update the perceptual-hash index of the dataset.")
+    parser.add_argument('--workers', type=int, default=None, help="Hashing processes (default: PRAMAAN_FEATURE_WORKERS or all cores).")
+    parser.add_argument('--path', default=TEMPLATE_INDEX_PATH, help=f"Index file (default: {TEMPLATE_INDEX_PATH}).")
+    args = parser.parse_args()
+    summary = build_index(args.path, workers=args.workers)
+    print(f"Indexed {summary['entries']} documents into {args.path} "
+          f"({summary['hashed']} hashed, {summary['reused']} reused, {summary['skipped']} unreadable).")
@@ -0,0 +1,198 @@
+# -----------------------------------------------------------------------------
+# Pramaan Dataset Featurizer
+#
+# Turns the labelled 'dataset/real' and 'dataset/fake' folders into a feature
+# matrix for the trainer and the RL environment. Extraction runs in a process
+# pool, and results are cached on disk by file content hash, feature schema
+# version and resolution budget, so a rerun only extracts features for new or
+# changed files.
+# -----------------------------------------------------------------------------
+
+import numpy as np
+import os
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from pramaan_features import FEATURE_SCHEMA_VERSION, MAX_ANALYSIS_PIXELS, NUM_FEATURES, extract_features, extract_metrics, valid_rows
+from pdf_pages import PDF_DPI, render_page
+from feedback_log import FeedbackLog
+
+# --- Configuration ---
+DATASET_PATH = 'dataset'
+REAL_PATH = os.path.join(DATASET_PATH, 'real')
+FAKE_PATH = os.path.join(DATASET_PATH, 'fake')
+FEATURE_CACHE_PATH = os.path.join(DATASET_PATH, 'features.cache.npz')
+# Default worker count; falls back to one process per core.
+FEATURE_WORKERS = os.environ.get('PRAMAAN_FEATURE_WORKERS')
+# REWARD_TABLE[true_label, predicted_label] for labels 0 = real, 1 = fake:
+# +10 for a correct call, -50 for a false positive (flagging a real doc as
+# fake), -20 for a false negative. Used by PramaanEnv and for model selection.
+REWARD_TABLE = np.array([[10.0, -50.0],
+                         [-20.0, 10.0]])
+# On Windows, you may need to provide the poppler path here for the trainer
+poppler_path_train = r"C:\poppler-25.07.0\Library\bin"
+
+# -----------------------------------------------------------------------------
+# Samples
+# -----------------------------------------------------------------------------
+def list_dataset_files(folder: str) -> list:
+    """Lists the samples in a dataset folder, skipping leftover '*.tmp.*' artifacts."""
+    return [os.path.join(folder, f) for f in sorted(os.listdir(folder)) if '.tmp.' not in f]
+
+def file_digest(filepath: str) -> bytes:
+    """SHA-256 of a file's content, read in 1 MiB chunks."""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+def render_pdf_first_page(pdf_path: str):
+    """Rasterizes the first page of a PDF at the service's PDF_DPI to a BGR array, or None on failure."""
+    try:
+        return render_page(pdf_path, 1, poppler_path=poppler_path_train)
+    except Exception as e:
+        print(f"Warning: Could not convert PDF '{os.path.basename(pdf_path)}'. Skipping. Error: {e}")
+        return None
+
+def featurize_sample(filepath: str):
+    """Feature vector of one dataset file (PDFs are analyzed through their first page), or None."""
+    if filepath.lower().endswith('.pdf'):
+        page = render_pdf_first_page(filepath)
+        return extract_metrics(None, image=page)[0] if page is not None else None
+    return extract_features(filepath)
+
+# -----------------------------------------------------------------------------
+# Parallel Extraction
+# -----------------------------------------------------------------------------
+def resolve_workers(workers=None) -> int:
+    """Worker count from the argument, then PRAMAAN_FEATURE_WORKERS, then the core count."""
+    workers = workers or FEATURE_WORKERS or os.cpu_count() or 1
+    return max(1, int(workers))
+
+def _init_worker():
+    # One OpenCV thread per process; the pool already provides the parallelism.
+    import cv2
+    cv2.setNumThreads(1)
+
+def featurize_many(filepaths: list, workers=None, fn=featurize_sample) -> list:
+    """Runs `fn` (featurize_sample by default) over many files, in a process pool when workers > 1."""
+    workers = min(resolve_workers(workers), len(filepaths))
+    if workers <= 1:
+        return [fn(p) for p in filepaths]
+    chunksize = max(1, len(filepaths) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        return list(pool.map(fn, filepaths, chunksize=chunksize))
+
+def featurize_source(source):
+    """Feature vector of a path (as featurize_sample) or of an in-memory image buffer, or None."""
+    if isinstance(source, (str, os.PathLike)):
+        return featurize_sample(source)
+    return extract_features(source)
+
+def extract_batch(sources, workers=None) -> np.ndarray:
+    """
+    Featurizes many paths and/or in-memory buffers (bytes, bytearray,
+    memoryview) into one C-contiguous float32 matrix of shape
+    (N, NUM_FEATURES), in a process pool when workers > 1. Rows that could not
+    be extracted are NaN; use valid_rows() to filter them.
+    """
+    # Buffers cross the process boundary by pickling, which memoryview cannot do.
+    sources = [bytes(s) if isinstance(s, memoryview) else s for s in sources]
+    X = np.full((len(sources), NUM_FEATURES), np.nan, dtype=np.float32)
+    for i, vec in enumerate(featurize_many(sources, workers, fn=featurize_source)):
+        if vec is not None: X[i] = vec
+    return X
+
+# -----------------------------------------------------------------------------
+# Feature Cache
+# -----------------------------------------------------------------------------
+def _load_cache(cache_path: str):
+    """
+    Returns ({digest: feature_row}, {path: (size, mtime_ns, digest)}) from the
+    cache file. A missing or unreadable cache, or one built with another schema,
+    resolution budget or PDF DPI, yields empty maps.
+    """
+    try:
+        with np.load(cache_path, allow_pickle=False) as data:
+            if (int(data['schema_version']) != FEATURE_SCHEMA_VERSION or int(data['max_analysis_pixels']) != MAX_ANALYSIS_PIXELS
+                    or int(data['pdf_dpi']) != PDF_DPI):
+                return {}, {}
+            rows = dict(zip(data['digests'].tolist(), data['features']))
+            stats = {p: (int(s), int(m), d) for p, s, m, d in zip(data['paths'].tolist(), data['sizes'], data['mtimes'], data['path_digests'].tolist())}
+            return rows, stats
+    except (OSError, KeyError, ValueError):
+        return {}, {}
+
+def _save_cache(cache_path: str, rows: dict, stats: dict):
+    """Writes the cache atomically so an interrupted run never leaves a torn file."""
+    paths = list(stats)
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'wb') as fh:
+        np.savez(fh,
+                 schema_version=np.int64(FEATURE_SCHEMA_VERSION),
+                 max_analysis_pixels=np.int64(MAX_ANALYSIS_PIXELS),
+                 pdf_dpi=np.int64(PDF_DPI),
+                 digests=np.array(list(rows), dtype='S32'),
+                 features=np.array(list(rows.values()), dtype=np.float32).reshape(-1, NUM_FEATURES),
+                 paths=np.array(paths, dtype=str),
+                 sizes=np.array([stats[p][0] for p in paths], dtype=np.int64),
+                 mtimes=np.array([stats[p][1] for p in paths], dtype=np.int64),
+                 path_digests=np.array([stats[p][2] for p in paths], dtype='S32'))
+    os.replace(tmp_path, cache_path)
+
+def featurize_files(filepaths: list, workers=None, cache_path: str = FEATURE_CACHE_PATH):
+    """
+    Returns (X, digests): the (N, NUM_FEATURES) float32 feature matrix of the
+    given files, in order, and their raw SHA-256 digests. Files whose content
+    is already in the cache are not re-extracted; files that cannot be
+    featurized get a NaN row (see valid_rows). Failures are not cached, so
+    they are retried on the next run (e.g. once poppler is installed).
+    """
+    rows, stats = _load_cache(cache_path) if cache_path else ({}, {})
+    digests, dirty = [], False
+    for path in filepaths:
+        st = os.stat(path)
+        known = stats.get(path)
+        if known and known[:2] == (st.st_size, st.st_mtime_ns):
+            digest = known[2]
+        else:
+            digest = file_digest(path)
+            stats[path] = (st.st_size, st.st_mtime_ns, digest)
+            dirty = True
+        digests.append(digest)
+
+    # Identical files are only extracted once. NaN rows may come from caches
+    # written before failures were left out.
+    todo = {d: p for d, p in zip(digests, filepaths) if d not in rows or not np.isfinite(rows[d]).all()}
+    if todo:
+        print(f"Extracting features for {len(todo)} new, changed or previously failed files...")
+        for digest, row in zip(todo, extract_batch(list(todo.values()), workers)):
+            rows[digest] = row
+        dirty = True
+    if cache_path and dirty:
+        _save_cache(cache_path, {d: row for d, row in rows.items() if np.isfinite(row).all()}, stats)
+
+    X = np.empty((len(filepaths), NUM_FEATURES), dtype=np.float32)
+    for i, digest in enumerate(digests):
+        X[i] = rows[digest]
+    return X, digests
+
+def load_labelled_dataset(workers=None, cache_path: str = FEATURE_CACHE_PATH, feedback_path: str = None):
+    """
+    Returns (X, y) for every usable file in the dataset: label 0 = real, 1 = fake.
+    With `feedback_path`, the adjudicated rows of that feedback log are added
+    as they were featurized by the service; a document's feedback label
+    replaces its dataset label.
+    """
+    real_files = list_dataset_files(REAL_PATH)
+    fake_files = list_dataset_files(FAKE_PATH)
+    X, digests = featurize_files(real_files + fake_files, workers=workers, cache_path=cache_path)
+    y = np.array([0] * len(real_files) + [1] * len(fake_files))
+    if feedback_path:
+        fb_digests, fb_X, fb_y = FeedbackLog(feedback_path).load()
+        if len(fb_y):
+            print(f"Adding {len(fb_y)} adjudicated documents from {feedback_path}.")
+            keep = ~np.isin(np.array(digests, dtype='S32'), fb_digests)
+            X, y = np.concatenate([X[keep], fb_X]), np.concatenate([y[keep], fb_y])
+    ok = valid_rows(X)
+    return X[ok], y[ok]
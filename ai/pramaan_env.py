@@ -4,117 +4,57 @@
 # This script defines the custom Gymnasium environment for our AI detective.
 # It handles loading the dataset, presenting evidence (states), and providing
 # rewards for correct classifications.
+#
+# PramaanVectorEnv is the batched variant for training: one shared feature
+# matrix, thousands of cases per step() and vectorized rewards, exposed through
+# Gymnasium's VectorEnv API (and Stable-Baselines3's VecEnv API, if installed).
 # -----------------------------------------------------------------------------
 
 import gymnasium as gym
 from gymnasium import spaces
+from gymnasium.vector import AutoresetMode, VectorEnv
+from gymnasium.vector.utils import batch_space
 import numpy as np
-import os
-import cv2
-from PIL import Image
-import piexif
 from sklearn.preprocessing import StandardScaler
+from pramaan_features import NUM_FEATURES
+from pramaan_dataset import REWARD_TABLE, load_labelled_dataset
+
+# Features come from the shared, cached dataset featurizer, so the environment
+# always sees exactly what the trainer and the API see.
 
-# --- IMPORTANT: Feature Extraction Logic ---
-# This section MUST be an exact copy of the feature extraction from your
-# most up-to-date training script to ensure consistency.
-# ---
-DATASET_PATH = 'dataset'
-REAL_PATH = os.path.join(DATASET_PATH, 'real')
-FAKE_PATH = os.path.join(DATASET_PATH, 'fake')
-
-def get_ela_metrics(filepath: str) -> dict:
-    TEMP_ELA_FILE = filepath + '.ela.tmp.jpg'
-    try:
-        original = Image.open(filepath)
-        if original.mode != 'RGB': original = original.convert('RGB')
-        original.save(TEMP_ELA_FILE, 'JPEG', quality=95)
-        original_cv, resaved_cv = cv2.imread(filepath), cv2.imread(TEMP_ELA_FILE)
-        diff = cv2.absdiff(original_cv, resaved_cv)
-        return { 'ela_mean': float(diff.mean()), 'ela_std': float(diff.std()), 'ela_max': float(diff.max()), 'ela_contrast': float(diff.max()) - float(diff.min()) }
-    except Exception:
-        return {'ela_mean': 0.0, 'ela_std': 0.0, 'ela_max': 0.0, 'ela_contrast': 0.0}
-    finally:
-        if os.path.exists(TEMP_ELA_FILE): os.remove(TEMP_ELA_FILE)
-
-def analyze_exif(filepath: str) -> dict:
-    try:
-        exif_dict = piexif.load(filepath)
-        software_tag_present = 1 if piexif.ImageIFD.Software in exif_dict['0th'] else 0
-        has_date_info = 1 if piexif.ImageIFD.DateTime in exif_dict['0th'] else 0
-        return {'software_tag': float(software_tag_present), 'has_date_info': float(has_date_info)}
-    except Exception:
-        return {'software_tag': 1.0, 'has_date_info': 0.0}
-
-def analyze_forensic_metrics(image: np.ndarray) -> dict:
-    b, g, r = cv2.split(image)
-    std_dev_r, std_dev_g, std_dev_b = float(np.std(r)), float(np.std(g)), float(np.std(b))
-    corr_gb = np.corrcoef(g.flatten(), b.flatten())[0, 1]
-    corr_gr = np.corrcoef(g.flatten(), r.flatten())[0, 1]
-    corr_br = np.corrcoef(b.flatten(), r.flatten())[0, 1]
-    avg_corr = (corr_gb + corr_gr + corr_br) / 3.0
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    noise_variance = np.var(gray - cv2.GaussianBlur(gray, (5, 5), 0))
-    laplacian_variance = np.var(cv2.Laplacian(gray, cv2.CV_64F))
-    return {'laplacian_variance': float(laplacian_variance), 'noise_variance': float(noise_variance), 'cross_channel_correlation': float(avg_corr) if not np.isnan(avg_corr) else 0.0, 'std_dev_r': std_dev_r, 'std_dev_g': std_dev_g, 'std_dev_b': std_dev_b }
-
-def extract_features(filepath: str):
-    try:
-        ela_metrics = get_ela_metrics(filepath)
-        exif_metrics = analyze_exif(filepath)
-        image = cv2.imread(filepath)
-        if image is None: return None
-        other_metrics = analyze_forensic_metrics(image)
-        return [ ela_metrics['ela_mean'], ela_metrics['ela_std'], ela_metrics['ela_max'], ela_metrics['ela_contrast'], other_metrics['laplacian_variance'], other_metrics['noise_variance'], other_metrics['cross_channel_correlation'], other_metrics['std_dev_r'], other_metrics['std_dev_g'], other_metrics['std_dev_b'], exif_metrics['software_tag'], exif_metrics['has_date_info'] ]
-    except Exception:
-        return None
-# --- End of copied feature extraction ---
+def load_env_dataset(workers=None):
+    """Returns (X, y, scaler): the standardized float64 feature matrix, labels and the fitted scaler."""
+    print("Loading dataset for RL environment...")
+    features, labels = load_labelled_dataset(workers=workers)
+    if not len(features):
+        raise ValueError("No features could be extracted. Is the dataset empty?")
+    # Scale features for better performance
+    scaler = StandardScaler().fit(features)
+    print("Dataset loaded and scaled.")
+    return scaler.transform(features).astype(np.float64), labels, scaler
 
 class PramaanEnv(gym.Env):
     """A custom Gym environment for the Pramaan Tampering Detector."""
     
-    def __init__(self):
+    def __init__(self, workers=None, dataset=None):
         super(PramaanEnv, self).__init__()
         
         # Define the action space: 0 for 'real', 1 for 'fake'
         self.action_space = spaces.Discrete(2)
         
-        # Define the observation space (our 13 forensic features)
+        # Define the observation space (our forensic features, see FEATURE_NAMES)
         # We set low and high bounds for the feature values
-        self.observation_space = spaces.Box(low=-np.inf, high=np.inf, shape=(12,), dtype=np.float64)
+        self.observation_space = spaces.Box(low=-np.inf, high=np.inf, shape=(NUM_FEATURES,), dtype=np.float64)
         
-        # Load and process the dataset
-        self._load_dataset()
+        # Load and process the dataset; pass `dataset` (see load_env_dataset)
+        # to share one matrix between copies instead of loading it again.
+        self.X, self.y, self.scaler = dataset if dataset is not None else load_env_dataset(workers)
         self.current_case_index = 0
-        
-    def _load_dataset(self):
-        """Loads all features and labels from the dataset folder."""
-        print("Loading dataset for RL environment...")
-        features, labels = [], []
-        
-        real_files = [os.path.join(REAL_PATH, f) for f in os.listdir(REAL_PATH)]
-        fake_files = [os.path.join(FAKE_PATH, f) for f in os.listdir(FAKE_PATH)]
-        
-        for filepath in real_files:
-            vec = extract_features(filepath)
-            if vec: features.append(vec); labels.append(0)
-        for filepath in fake_files:
-            vec = extract_features(filepath)
-            if vec: features.append(vec); labels.append(1)
-            
-        if not features:
-            raise ValueError("No features could be extracted. Is the dataset empty?")
-            
-        # Scale features for better performance
-        self.scaler = StandardScaler().fit(features)
-        self.X = self.scaler.transform(features)
-        self.y = np.array(labels)
-        print("Dataset loaded and scaled.")
-
-    def reset(self, seed=None):
+
+    def reset(self, *, seed=None, options=None):
         """Resets the environment to a new random case."""
         super().reset(seed=seed)
-        self.current_case_index = np.random.randint(len(self.X))
+        self.current_case_index = int(self.np_random.integers(len(self.X)))
         observation = self.X[self.current_case_index]
         info = {} # You can add extra info here if needed
         return observation, info
@@ -123,14 +63,9 @@ class PramaanEnv(gym.Env):
         """Execute one time step within the environment."""
         true_label = self.y[self.current_case_index]
         
-        # --- The Reward System ---
-        if action == true_label:
-            reward = 10  # Correct classification
-        elif action == 1 and true_label == 0: # False Positive
-            reward = -50 # Heavily penalize flagging a real doc as fake
-        else: # False Negative
-            reward = -20 # Penalize letting a fake doc pass
-            
+        # --- The Reward System (see REWARD_TABLE) ---
+        reward = int(REWARD_TABLE[true_label, int(action)])
+
         # An episode is done after one classification
         terminated = True 
         truncated = False # Not used in our case
@@ -141,3 +76,94 @@ class PramaanEnv(gym.Env):
         observation = self.X[self.current_case_index]
         
         return observation, reward, terminated, truncated, info
+
+class PramaanVectorEnv(VectorEnv):
+    """
+    `num_envs` single-step cases per step(), all drawn from one shared
+    feature matrix. Every case terminates after its classification and the
+    next case is drawn in the same step (AutoresetMode.SAME_STEP), so each
+    step() classifies num_envs fresh cases. Sampling uses self.np_random and
+    is reproducible with reset(seed=...).
+    """
+
+    metadata = {'autoreset_mode': AutoresetMode.SAME_STEP}
+
+    def __init__(self, num_envs: int = 1024, workers=None, dataset=None):
+        self.X, self.y, self.scaler = dataset if dataset is not None else load_env_dataset(workers)
+        self.num_envs = num_envs
+        self.single_action_space = spaces.Discrete(2)
+        self.single_observation_space = spaces.Box(low=-np.inf, high=np.inf, shape=(NUM_FEATURES,), dtype=np.float64)
+        self.action_space = batch_space(self.single_action_space, num_envs)
+        self.observation_space = batch_space(self.single_observation_space, num_envs)
+        self.case_indices = np.zeros(num_envs, dtype=np.int64)
+        self._all_done = np.ones(num_envs, dtype=bool)
+        self._none_truncated = np.zeros(num_envs, dtype=bool)
+
+    def _draw(self) -> np.ndarray:
+        self.case_indices = self.np_random.integers(len(self.X), size=self.num_envs)
+        return self.X[self.case_indices]
+
+    def reset(self, *, seed=None, options=None):
+        """Draws a new random case for every sub-environment."""
+        super().reset(seed=seed)
+        return self._draw(), {}
+
+    def step(self, actions):
+        """Scores num_envs classifications at once and draws the next cases."""
+        actions = np.asarray(actions, dtype=np.int64)
+        true_labels = self.y[self.case_indices]
+        rewards = REWARD_TABLE[true_labels, actions]
+        final_obs = self.X[self.case_indices]
+        observations = self._draw()
+        infos = {
+            'true_label': true_labels,
+            'predicted_label': actions,
+            'final_obs': final_obs,
+            '_final_obs': self._all_done,
+        }
+        return observations, rewards, self._all_done.copy(), self._none_truncated.copy(), infos
+
+try:
+    from stable_baselines3.common.vec_env import VecEnv
+except ImportError:  # Optional: only needed to train with Stable-Baselines3.
+    VecEnv = None
+
+if VecEnv is not None:
+    class PramaanSB3VecEnv(VecEnv):
+        """Stable-Baselines3 VecEnv view of a PramaanVectorEnv (SB3 does not accept Gymnasium vector envs)."""
+
+        def __init__(self, vector_env: PramaanVectorEnv):
+            self.vector_env = vector_env
+            super().__init__(vector_env.num_envs, vector_env.single_observation_space, vector_env.single_action_space)
+            self._actions = None
+
+        def reset(self):
+            seed = self._seeds[0] if getattr(self, '_seeds', None) else None
+            observations, _ = self.vector_env.reset(seed=seed)
+            if hasattr(self, '_reset_seeds'): self._reset_seeds()
+            return observations
+
+        def step_async(self, actions):
+            self._actions = actions
+
+        def step_wait(self):
+            observations, rewards, terminated, truncated, infos = self.vector_env.step(self._actions)
+            final_obs = infos['final_obs']
+            sb3_infos = [{'terminal_observation': final_obs[i]} for i in range(self.num_envs)]
+            return observations, rewards.astype(np.float32), terminated | truncated, sb3_infos
+
+        def close(self):
+            self.vector_env.close()
+
+        def get_attr(self, attr_name, indices=None):
+            return [getattr(self.vector_env, attr_name)] * len(self._get_indices(indices))
+
+        def set_attr(self, attr_name, value, indices=None):
+            setattr(self.vector_env, attr_name, value)
+
+        def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+            result = getattr(self.vector_env, method_name)(*method_args, **method_kwargs)
+            return [result] * len(self._get_indices(indices))
+
+        def env_is_wrapped(self, wrapper_class, indices=None):
+            return [False] * len(self._get_indices(indices))
@@ -0,0 +1,322 @@
+# -----------------------------------------------------------------------------
+# Pramaan Feature Extraction Engine
+#
+# The single implementation of the forensic feature vector shared by the
+# trainer, the RL environment and the API. Any change that alters the value
+# or the order of a feature MUST bump FEATURE_SCHEMA_VERSION, so that a model
+# trained on an older schema is refused instead of silently mis-scoring.
+# -----------------------------------------------------------------------------
+
+import cv2
+import numpy as np
+import os
+import io
+import time
+from PIL import Image
+import piexif
+
+# Schema history:
+#   1 - the original 12 features.
+#   2 - noise_variance uses a signed residual (v1 wrapped around in uint8).
+#   3 - block-wise ELA and noise statistics (ela_block_*, noise_block_*).
+FEATURE_SCHEMA_VERSION = 3
+
+# Column order of the feature matrix. The trainer, PramaanEnv and the API all
+# index features through this tuple.
+FEATURE_NAMES = (
+    'ela_mean', 'ela_std', 'ela_max', 'ela_contrast',
+    'laplacian_variance', 'noise_variance', 'cross_channel_correlation',
+    'std_dev_r', 'std_dev_g', 'std_dev_b',
+    'software_tag', 'has_date_info',
+    'ela_block_max_z', 'ela_block_spread', 'noise_block_max_z', 'noise_block_spread',
+)
+NUM_FEATURES = len(FEATURE_NAMES)
+
+# Pixels per block of the fused channel-statistics pass (a ~2 MiB float64 buffer).
+STATS_BLOCK_PIXELS = 1 << 16
+
+# --- Block Maps ---
+# ELA and noise are also summarized per tile of about BLOCK_SIZE pixels (a
+# multiple of the 8x8 JPEG grid), so that a small edit is not averaged away
+# over the whole page. Tiles are stretched slightly so no edge tile is a sliver.
+BLOCK_SIZE = 32
+# Pixels per band of the tile pass (two float64 integral images of ~16 MiB).
+BLOCK_BAND_PIXELS = 1 << 20
+# Tiles scoring at least this robust z-score form the reported suspect region.
+ANOMALY_Z = 4.0
+HEATMAP_CELLS = 16
+
+# --- Resolution Budget ---
+# Images above MAX_ANALYSIS_PIXELS are analyzed on a deterministically
+# downscaled copy. The value is stamped into the model pickle, because the
+# features of a large image depend on it. Anything whose header claims more
+# than MAX_DECODE_PIXELS is rejected before it is decoded.
+MAX_ANALYSIS_PIXELS = int(os.environ.get('PRAMAAN_MAX_ANALYSIS_PIXELS', 8_000_000))
+MAX_DECODE_PIXELS = int(os.environ.get('PRAMAAN_MAX_DECODE_PIXELS', 100_000_000))
+
+class ImageTooLargeError(ValueError):
+    """Raised when an image's declared size exceeds MAX_DECODE_PIXELS."""
+
+# -----------------------------------------------------------------------------
+# Decoding
+# -----------------------------------------------------------------------------
+def image_dimensions(source):
+    """(width, height) from the image header without decoding pixels, or None if unknown."""
+    try:
+        with Image.open(io.BytesIO(source) if isinstance(source, (bytes, bytearray, memoryview)) else source) as img:
+            return img.size
+    except Image.DecompressionBombError as e:
+        raise ImageTooLargeError(str(e))
+    except Exception:
+        return None
+
+def _reduced_decode_flag(width: int, height: int) -> int:
+    """The largest IMREAD_REDUCED_COLOR_* factor that still leaves at least MAX_ANALYSIS_PIXELS."""
+    for factor, flag in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)):
+        if width * height >= MAX_ANALYSIS_PIXELS * factor * factor:
+            return flag
+    return cv2.IMREAD_COLOR
+
+def fit_to_budget(image: np.ndarray) -> np.ndarray:
+    """Downscales an image with INTER_AREA so it holds at most MAX_ANALYSIS_PIXELS."""
+    h, w = image.shape[:2]
+    if h * w <= MAX_ANALYSIS_PIXELS:
+        return image
+    scale = (MAX_ANALYSIS_PIXELS / (h * w)) ** 0.5
+    return cv2.resize(image, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+
+def load_image(source) -> np.ndarray:
+    """
+    Decodes a file path or an in-memory buffer (bytes, bytearray, memoryview)
+    to BGR within the resolution budget. Raises ImageTooLargeError when the
+    header declares more than MAX_DECODE_PIXELS; returns None if undecodable.
+    JPEG decoders scale down by 2/4/8 while decoding, so a large photo is
+    never held at full size.
+    """
+    size = image_dimensions(source)
+    if size and size[0] * size[1] > MAX_DECODE_PIXELS:
+        raise ImageTooLargeError(f"Image is {size[0]}x{size[1]}; the limit is {MAX_DECODE_PIXELS} pixels.")
+    flag = _reduced_decode_flag(*size) if size else cv2.IMREAD_COLOR
+    try:
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            # imdecode asserts on an empty buffer instead of returning None.
+            if len(source) == 0: return None
+            image = cv2.imdecode(np.frombuffer(source, dtype=np.uint8), flag)
+        else:
+            image = cv2.imread(source, flag)
+    except cv2.error:
+        return None
+    return fit_to_budget(image) if image is not None else None
+
+def from_pil(pil_image) -> np.ndarray:
+    """BGR array of an already-decoded PIL image (e.g. a rendered PDF page), within the budget."""
+    return fit_to_budget(cv2.cvtColor(np.asarray(pil_image.convert('RGB')), cv2.COLOR_RGB2BGR))
+
+# -----------------------------------------------------------------------------
+# Individual Analyses
+# -----------------------------------------------------------------------------
+def block_edges(length: int) -> np.ndarray:
+    """Tile boundaries along one axis: round(length / BLOCK_SIZE) near-equal tiles."""
+    return np.linspace(0, length, max(1, round(length / BLOCK_SIZE)) + 1).astype(np.intp)
+
+def block_moments(plane: np.ndarray, rows: np.ndarray, cols: np.ndarray) -> tuple:
+    """
+    Per-tile mean and variance maps of a single-channel plane. Integral images
+    of the values and their squares are built for a band of tile rows at a
+    time, and each tile's sums are read off its four corners.
+    """
+    counts = np.outer(np.diff(rows), np.diff(cols))
+    sums, squares = np.empty(counts.shape), np.empty(counts.shape)
+    tiles_per_band = max(1, BLOCK_BAND_PIXELS // (plane.shape[1] * BLOCK_SIZE))
+    for i in range(0, len(rows) - 1, tiles_per_band):
+        edges = rows[i:i + tiles_per_band + 1]
+        band_sum, band_sq = cv2.integral2(plane[edges[0]:edges[-1]], sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+        for integral, out in ((band_sum, sums), (band_sq, squares)):
+            corners = integral[(edges - edges[0])[:, None], cols]
+            out[i:i + len(edges) - 1] = np.diff(np.diff(corners, axis=0), axis=1)
+    mean = sums / counts
+    return mean, np.maximum(squares / counts - mean * mean, 0.0)
+
+def _robust_z(values: np.ndarray, floor: float) -> np.ndarray:
+    """Distance from the median in normal-consistent MADs; the MAD is floored so a uniform page does not blow up."""
+    median = np.median(values)
+    return (values - median) / max(1.4826 * float(np.median(np.abs(values - median))), floor)
+
+def _spread(values: np.ndarray) -> float:
+    """Interdecile range."""
+    low, high = np.percentile(values, (10, 90))
+    return float(high - low)
+
+def get_ela_metrics(image: np.ndarray, maps: dict = None) -> dict:
+    """
+    Error Level Analysis in memory: re-encode the decoded image as JPEG (q=95)
+    and diff. Besides whole-image statistics, it measures the tile whose mean
+    error deviates most from the rest of the page, in either direction
+    (ela_block_max_z), and the spread of per-tile error variance. If `maps`
+    is given, the per-tile z-scores are stored in it (see anomaly_summary).
+    """
+    try:
+        buffer = io.BytesIO()
+        Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB)).save(buffer, 'JPEG', quality=95)
+        resaved = cv2.imdecode(np.frombuffer(buffer.getbuffer(), dtype=np.uint8), cv2.IMREAD_COLOR)
+        diff = cv2.absdiff(image, resaved)
+        # One plane over all channels, so OpenCV reduces it without a float64 copy.
+        flat = diff.reshape(image.shape[0], -1)
+        mean, std = cv2.meanStdDev(flat)
+        diff_min, diff_max, _, _ = cv2.minMaxLoc(flat)
+        rows, cols = block_edges(image.shape[0]), block_edges(image.shape[1])
+        block_mean, block_var = block_moments(cv2.cvtColor(diff, cv2.COLOR_BGR2GRAY), rows, cols)
+        # A region saved at another quality shows more error or less, depending on the host.
+        z = _robust_z(block_mean, 1.0)
+        if maps is not None:
+            maps.update(ela=z, rows=rows, cols=cols)
+        return { 'ela_mean': float(mean[0, 0]), 'ela_std': float(std[0, 0]), 'ela_max': float(diff_max), 'ela_contrast': float(diff_max) - float(diff_min),
+                 'ela_block_max_z': float(np.abs(z).max()), 'ela_block_spread': _spread(np.log1p(block_var)) }
+    except Exception:
+        return {'ela_mean': 0.0, 'ela_std': 0.0, 'ela_max': 0.0, 'ela_contrast': 0.0, 'ela_block_max_z': 0.0, 'ela_block_spread': 0.0}
+
+def analyze_exif(source) -> dict:
+    """Reads the EXIF flags from a file path or an in-memory buffer."""
+    try:
+        exif_dict = piexif.load(bytes(source) if isinstance(source, (bytearray, memoryview)) else source)
+        software_tag_present = 1 if piexif.ImageIFD.Software in exif_dict['0th'] else 0
+        has_date_info = 1 if piexif.ImageIFD.DateTime in exif_dict['0th'] else 0
+        return {'software_tag': float(software_tag_present), 'has_date_info': float(has_date_info)}
+    except Exception:
+        return {'software_tag': 1.0, 'has_date_info': 0.0}
+
+def channel_moments(image: np.ndarray):
+    """
+    Means and 3x3 covariance of the B, G, R channels in one blocked pass.
+
+    Each block of pixels is widened into a small float64 buffer with a column
+    of ones and folded into a 4x4 Gram matrix. Its entries are sums of integer
+    products, which float64 holds exactly, so the statistics match np.std and
+    np.corrcoef without their full-size flatten copies.
+    """
+    pixels = image.reshape(-1, 3)
+    block = np.ones((min(STATS_BLOCK_PIXELS, len(pixels)), 4))
+    gram = np.zeros((4, 4))
+    for start in range(0, len(pixels), STATS_BLOCK_PIXELS):
+        chunk = pixels[start:start + STATS_BLOCK_PIXELS]
+        view = block[:len(chunk)]
+        view[:, :3] = chunk
+        gram += view.T @ view
+    n = gram[3, 3]
+    means = gram[:3, 3] / n
+    return means, gram[:3, :3] / n - np.outer(means, means)
+
+def analyze_forensic_metrics(image: np.ndarray) -> dict:
+    """
+    Channel statistics, sharpness and noise. The noise residual is also
+    summarized per tile: the tile whose log noise variance deviates most from
+    the page (noise_block_max_z) and the spread of per-tile log variance.
+    """
+    _, cov = channel_moments(image)
+    std_dev_b, std_dev_g, std_dev_r = np.sqrt(np.clip(np.diag(cov), 0.0, None))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr_gb = cov[1, 0] / (std_dev_g * std_dev_b)
+        corr_gr = cov[1, 2] / (std_dev_g * std_dev_r)
+        corr_br = cov[0, 2] / (std_dev_b * std_dev_r)
+    avg_corr = np.clip((corr_gb + corr_gr + corr_br) / 3.0, -1.0, 1.0)
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    # Signed residual; schema v1 subtracted in uint8 and wrapped around.
+    residual = cv2.subtract(gray, cv2.GaussianBlur(gray, (5, 5), 0), dtype=cv2.CV_16S)
+    noise_variance = cv2.meanStdDev(residual)[1][0, 0] ** 2
+    log_block_var = np.log1p(block_moments(residual, block_edges(gray.shape[0]), block_edges(gray.shape[1]))[1])
+    z = _robust_z(log_block_var, 0.5)
+    # 8-bit Laplacian responses are small integers, exact in float32.
+    laplacian_variance = cv2.meanStdDev(cv2.Laplacian(gray, cv2.CV_32F))[1][0, 0] ** 2
+    return { 'laplacian_variance': float(laplacian_variance), 'noise_variance': float(noise_variance), 'cross_channel_correlation': float(avg_corr) if not np.isnan(avg_corr) else 0.0, 'std_dev_r': float(std_dev_r), 'std_dev_g': float(std_dev_g), 'std_dev_b': float(std_dev_b),
+             'noise_block_max_z': float(np.abs(z).max()), 'noise_block_spread': _spread(log_block_var) }
+
+def anomaly_summary(maps: dict) -> dict:
+    """
+    Compact view of the ELA tile map filled by extract_metrics, or None. Each
+    tile scores the absolute z-score of its mean error level. 'heatmap'
+    max-pools the scores onto at most HEATMAP_CELLS x HEATMAP_CELLS cells,
+    one digit per cell (the score rounded down, 0-9). 'box' bounds the tiles
+    scoring at least ANOMALY_Z that are connected to the highest-scoring
+    tile, in fractions of the image width and height, or is None. Noise tiles
+    are left out: their variance follows the amount of text in a tile, which
+    would outline the content of a genuine page.
+    """
+    if 'ela' not in maps:
+        return None
+    score = np.abs(maps['ela'])
+    rows, cols = maps['rows'], maps['cols']
+    cell_rows = np.linspace(0, score.shape[0], min(score.shape[0], HEATMAP_CELLS) + 1).astype(np.intp)[:-1]
+    cell_cols = np.linspace(0, score.shape[1], min(score.shape[1], HEATMAP_CELLS) + 1).astype(np.intp)[:-1]
+    pooled = np.maximum.reduceat(np.maximum.reduceat(score, cell_rows, axis=0), cell_cols, axis=1)
+    digits = np.clip(pooled, 0, 9).astype(np.uint8)
+    box = None
+    flagged = (score >= ANOMALY_Z).astype(np.uint8)
+    if flagged.any():
+        _, labels = cv2.connectedComponents(flagged, connectivity=8)
+        ys, xs = np.nonzero(labels == labels[np.unravel_index(np.argmax(score), score.shape)])
+        height, width = float(rows[-1]), float(cols[-1])
+        box = {'x': round(cols[xs.min()] / width, 4), 'y': round(rows[ys.min()] / height, 4),
+               'w': round((cols[xs.max() + 1] - cols[xs.min()]) / width, 4), 'h': round((rows[ys.max() + 1] - rows[ys.min()]) / height, 4)}
+    return {'maxScore': round(float(score.max()), 2), 'box': box,
+            'heatmap': {'rows': len(digits), 'cols': len(digits[0]), 'cells': [''.join(map(str, row)) for row in digits]}}
+
+# -----------------------------------------------------------------------------
+# Feature Vectors
+# -----------------------------------------------------------------------------
+def metrics_to_vector(metrics: dict) -> np.ndarray:
+    """Orders a metrics dict into a float32 feature vector of shape (NUM_FEATURES,)."""
+    return np.array([metrics[name] for name in FEATURE_NAMES], dtype=np.float32)
+
+def extract_metrics(source, image: np.ndarray = None, timings: dict = None, maps: dict = None):
+    """
+    Returns (feature_vector, metrics) for one path or buffer, or (None, None)
+    on failure. Pass `image` when the caller already holds load_image(source);
+    `source` may then be None for images without a file container (rendered
+    PDF pages), which get the no-EXIF defaults. ImageTooLargeError is raised
+    rather than swallowed. If `timings` is given, the milliseconds spent in
+    ELA, EXIF and the forensic statistics are added to it. If `maps` is
+    given, the ELA tile z-score map is stored in it (see anomaly_summary).
+    """
+    try:
+        if image is None: image = load_image(source)
+        if image is None: return None, None
+        metrics = {}
+        for stage, analyze in (('elaMs', lambda: get_ela_metrics(image, maps)), ('exifMs', lambda: analyze_exif(source)), ('forensicMs', lambda: analyze_forensic_metrics(image))):
+            started = time.perf_counter()
+            metrics.update(analyze())
+            if timings is not None:
+                timings[stage] = timings.get(stage, 0.0) + 1000.0 * (time.perf_counter() - started)
+        return metrics_to_vector(metrics), metrics
+    except ImageTooLargeError:
+        raise
+    except Exception:
+        return None, None
+
+def extract_features(source):
+    """Returns the float32 feature vector for one path or buffer, or None on failure."""
+    try:
+        return extract_metrics(source)[0]
+    except ImageTooLargeError:
+        return None
+
+def valid_rows(X: np.ndarray) -> np.ndarray:
+    """Boolean mask of the rows of a feature matrix that were extracted successfully."""
+    return np.isfinite(X).all(axis=1)
+
+# -----------------------------------------------------------------------------
+# Model Compatibility
+# -----------------------------------------------------------------------------
+def feature_signature() -> dict:
+    """Everything a trained model depends on besides its weights; stamped into the pickle."""
+    return {'feature_schema_version': FEATURE_SCHEMA_VERSION, 'feature_names': FEATURE_NAMES, 'max_analysis_pixels': MAX_ANALYSIS_PIXELS}
+
+def signature_mismatch(saved_model: dict):
+    """Describes why a saved model is incompatible with this extractor, or returns None."""
+    # Pickles written before the schema stamp existed were trained on schema 1.
+    model_schema = saved_model.get('feature_schema_version', 1)
+    if model_schema != FEATURE_SCHEMA_VERSION:
+        return f"Model was trained on feature schema v{model_schema}, but this service extracts v{FEATURE_SCHEMA_VERSION}."
+    model_budget = saved_model.get('max_analysis_pixels')
+    if model_budget != MAX_ANALYSIS_PIXELS:
+        return f"Model was trained with max_analysis_pixels={model_budget}, but PRAMAAN_MAX_ANALYSIS_PIXELS is {MAX_ANALYSIS_PIXELS}."
+    return None
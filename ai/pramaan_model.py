@@ -0,0 +1,203 @@
+# -----------------------------------------------------------------------------
+# Pramaan Model - Compiled Inference
+#
+# The trainer exports the fitted StandardScaler + GradientBoostingClassifier
+# into 'pramaan_model.npz': every tree's nodes concatenated into flat arrays,
+# with the scaler folded into the split thresholds, so serving needs neither
+# sklearn nor pickle. CompiledGBM walks all trees for all rows at once with
+# NumPy and returns labels and probabilities in one pass. Its raw scores and
+# labels are bit-for-bit identical to scaler.transform + model.predict_proba;
+# the probabilities are computed without scipy's expit and may differ from
+# sklearn's by one ulp.
+# -----------------------------------------------------------------------------
+
+import numpy as np
+import hashlib
+import io
+import os
+import pickle
+from pramaan_features import signature_mismatch
+
+# --- Configuration ---
+MODEL_PATH = 'pramaan_model.pkl'
+COMPILED_MODEL_PATH = 'pramaan_model.npz'
+# Bumped when the .npz layout changes.
+COMPILED_FORMAT_VERSION = 1
+
+# -----------------------------------------------------------------------------
+# Threshold Folding
+# -----------------------------------------------------------------------------
+# A tree compares the standardized float32 feature with a float64 threshold:
+#
+#     float32(scaler.transform(x)) <= threshold
+#
+# Every rounding step of the transform is monotone, so for a fixed feature
+# this holds exactly for the float32 values x <= T for some float32 T. T is
+# found by bisection over the float32 values in their integer order, probing
+# the scaler itself, which makes the folded comparison `x <= T` on raw
+# features agree with sklearn for every possible input.
+_MAX_FINITE = 0x7f7fffff  # Order key of the largest finite float32.
+
+def _to_float32(keys: np.ndarray) -> np.ndarray:
+    bits = np.where(keys >= 0, keys, (-keys) | 0x80000000).astype(np.uint32)
+    return bits.view(np.float32)
+
+def _goes_left(scaler, x: np.ndarray, feature: np.ndarray, threshold: np.ndarray) -> np.ndarray:
+    rows = np.arange(len(x))
+    probe = np.zeros((len(x), scaler.n_features_in_), dtype=np.float32)
+    probe[rows, feature] = x
+    with np.errstate(over='ignore'):
+        standardized = scaler.transform(probe)[rows, feature].astype(np.float32)
+    return standardized.astype(np.float64) <= threshold
+
+def fold_thresholds(scaler, threshold: np.ndarray, feature: np.ndarray) -> np.ndarray:
+    """Raw-feature float32 thresholds equivalent to standardized float64 ones (see above)."""
+    lo = np.full(threshold.shape, -_MAX_FINITE, dtype=np.int64)
+    hi = np.full(threshold.shape, _MAX_FINITE, dtype=np.int64)
+    # Invariant: every x <= lo goes left unless nothing does; every x > hi goes right.
+    none_left = ~_goes_left(scaler, _to_float32(lo), feature, threshold)
+    all_left = _goes_left(scaler, _to_float32(hi), feature, threshold)
+    while True:
+        open_ = hi - lo > 1
+        if not open_.any(): break
+        mid = lo + (hi - lo) // 2
+        left = _goes_left(scaler, _to_float32(mid), feature, threshold)
+        lo = np.where(open_ & left, mid, lo)
+        hi = np.where(open_ & ~left, mid, hi)
+    folded = _to_float32(lo).copy()
+    folded[none_left] = -np.inf
+    folded[all_left] = np.inf
+    return folded
+
+# -----------------------------------------------------------------------------
+# Export
+# -----------------------------------------------------------------------------
+def export_compiled(model, scaler, path: str, signature: dict):
+    """Writes a fitted binary GradientBoostingClassifier + StandardScaler as a flat-array .npz (atomically)."""
+    if model.n_classes_ != 2:
+        raise ValueError("Only binary classifiers can be compiled.")
+    trees = [est.tree_ for est in model.estimators_[:, 0]]
+    offsets = np.cumsum([0] + [t.node_count for t in trees])[:-1]
+    feature, threshold, left, right, value = [], [], [], [], []
+    for offset, t in zip(offsets, trees):
+        nodes = np.arange(t.node_count)
+        leaf = t.children_left == -1
+        # Leaves loop to themselves, so every row can take the same number of steps.
+        feature.append(np.where(leaf, 0, t.feature))
+        threshold.append(np.where(leaf, np.inf, t.threshold))
+        left.append(offset + np.where(leaf, nodes, t.children_left))
+        right.append(offset + np.where(leaf, nodes, t.children_right))
+        value.append(t.value[:, 0, 0])
+    feature = np.concatenate(feature).astype(np.int32)
+    threshold = np.concatenate(threshold)
+    threshold = fold_thresholds(scaler, threshold, feature)
+
+    init = model._raw_predict_init(np.zeros((1, model.n_features_in_), dtype=np.float32))[0, 0]
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as fh:
+        np.savez(fh,
+                 format_version=np.int64(COMPILED_FORMAT_VERSION),
+                 roots=offsets.astype(np.int32),
+                 feature=feature,
+                 threshold=threshold.astype(np.float32),
+                 left=np.concatenate(left).astype(np.int32),
+                 right=np.concatenate(right).astype(np.int32),
+                 value=np.concatenate(value).astype(np.float64),
+                 depth=np.int64(max(t.max_depth for t in trees)),
+                 init=np.float64(init),
+                 learning_rate=np.float64(model.learning_rate),
+                 n_features=np.int64(model.n_features_in_),
+                 feature_schema_version=np.int64(signature['feature_schema_version']),
+                 feature_names=np.array(signature['feature_names'], dtype=str),
+                 max_analysis_pixels=np.int64(signature['max_analysis_pixels']))
+    os.replace(tmp_path, path)
+
+# -----------------------------------------------------------------------------
+# Inference
+# -----------------------------------------------------------------------------
+class CompiledGBM:
+    """A compiled model loaded from .npz. predict() -> (labels, probabilities)."""
+
+    def __init__(self, data: dict, version: str):
+        self.version = version
+        self.roots = data['roots']
+        self.feature = data['feature']
+        self.threshold = data['threshold']
+        self.left = data['left']
+        self.right = data['right']
+        self.value = data['value']
+        self.depth = int(data['depth'])
+        self.init = float(data['init'])
+        self.learning_rate = float(data['learning_rate'])
+        self.n_features = int(data['n_features'])
+        self.signature = {
+            'feature_schema_version': int(data['feature_schema_version']),
+            'feature_names': tuple(data['feature_names'].tolist()),
+            'max_analysis_pixels': int(data['max_analysis_pixels']),
+        }
+
+    @classmethod
+    def load(cls, path: str = COMPILED_MODEL_PATH):
+        with open(path, 'rb') as fh:
+            raw = fh.read()
+        with np.load(io.BytesIO(raw), allow_pickle=False) as data:
+            if int(data['format_version']) != COMPILED_FORMAT_VERSION:
+                raise ValueError(f"Compiled model format v{int(data['format_version'])} is not supported.")
+            arrays = {name: data[name] for name in data.files}
+        return cls(arrays, hashlib.sha256(raw).hexdigest()[:16])
+
+    def raw_scores(self, features: np.ndarray) -> np.ndarray:
+        """Log-odds of the 'fake' class for an (N, NUM_FEATURES) float32 matrix."""
+        X = np.asarray(features, dtype=np.float32).reshape(-1, self.n_features)
+        flat = X.ravel()
+        row_base = (np.arange(len(X)) * self.n_features)[None, :]
+        # nodes[t, i]: where row i currently is in tree t; all trees advance together.
+        nodes = np.repeat(self.roots[:, None], len(X), axis=1)
+        for _ in range(self.depth):
+            go_left = flat.take(row_base + self.feature.take(nodes)) <= self.threshold.take(nodes)
+            nodes = np.where(go_left, self.left.take(nodes), self.right.take(nodes))
+        # sklearn adds the trees one by one; cumsum keeps that summation order.
+        terms = np.empty((len(self.roots) + 1, len(X)))
+        terms[0] = self.init
+        terms[1:] = self.learning_rate * self.value.take(nodes)
+        return np.cumsum(terms, axis=0)[-1]
+
+    def predict(self, features: np.ndarray) -> tuple:
+        """(labels, probabilities) for one row or a batch: labels (N,), probabilities (N, 2)."""
+        # expit without importing scipy for it; exp overflows to inf for very negative scores, giving 0.
+        with np.errstate(over='ignore'):
+            p_fake = 1.0 / (1.0 + np.exp(-self.raw_scores(features)))
+        probabilities = np.empty((len(p_fake), 2))
+        probabilities[:, 1] = p_fake
+        probabilities[:, 0] = 1 - p_fake
+        return probabilities.argmax(axis=1), probabilities
+
+class SklearnModel:
+    """The pickled scaler + classifier behind the same predict() interface."""
+
+    def __init__(self, saved_model: dict, version: str):
+        self.version = version
+        self.model = saved_model['model']
+        self.scaler = saved_model['scaler']
+        self.signature = saved_model
+
+    def predict(self, features: np.ndarray) -> tuple:
+        probabilities = self.model.predict_proba(self.scaler.transform(np.atleast_2d(features)))
+        return probabilities.argmax(axis=1), probabilities
+
+def load_model(compiled_path: str = COMPILED_MODEL_PATH, pickle_path: str = MODEL_PATH):
+    """
+    The compiled model when it exists, else the pickle. Raises
+    FileNotFoundError if neither exists, and ValueError if the model does not
+    match this feature extractor.
+    """
+    if os.path.exists(compiled_path):
+        model = CompiledGBM.load(compiled_path)
+    else:
+        with open(pickle_path, 'rb') as f:
+            model_bytes = f.read()
+        model = SklearnModel(pickle.loads(model_bytes), hashlib.sha256(model_bytes).hexdigest()[:16])
+    mismatch = signature_mismatch(model.signature)
+    if mismatch:
+        raise ValueError(mismatch)
+    return model
@@ -0,0 +1,151 @@
+# -----------------------------------------------------------------------------
+# Pramaan Service Metrics
+#
+# Per-stage latency summaries (p50/p95/p99 over a sliding window of recent
+# requests), counters, and their Prometheus text rendering for /ai/metrics.
+# Also a sampling profiler that can be attached to a single request: it
+# samples the request thread's stack and writes collapsed stacks, the input
+# format of flamegraph.pl and speedscope.
+#
+# Metrics are kept per process; under gunicorn each worker reports its own,
+# labelled with its pid.
+# -----------------------------------------------------------------------------
+
+import os
+import sys
+import threading
+from collections import Counter, deque
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+class StageSummary:
+    """Durations of one stage: running sum and count, plus a window of recent samples for quantiles."""
+
+    def __init__(self, window: int):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def quantiles(self) -> dict:
+        ordered = sorted(self.samples)
+        if not ordered: return {q: 0.0 for q in QUANTILES}
+        return {q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in QUANTILES}
+
+class MetricsRegistry:
+    """Thread-safe stage summaries and labelled counters."""
+
+    def __init__(self, window: int = 1024):
+        self.window = window
+        self._stages = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            summary = self._stages.get(stage)
+            if summary is None:
+                summary = self._stages[stage] = StageSummary(self.window)
+            summary.observe(seconds)
+
+    def observe_timings(self, timings: dict):
+        """Records a pipeline timings dict ({'ocrMs': 12.5, ...}) as one sample per stage."""
+        for key, ms in timings.items():
+            self.observe(key[:-2] if key.endswith('Ms') else key, ms / 1000.0)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._counters.setdefault(name, Counter())[key] += amount
+
+    def stage_report(self) -> dict:
+        """{stage: {count, p50Ms, p95Ms, p99Ms}} for JSON consumers."""
+        with self._lock:
+            return {stage: {'count': s.count, **{f'p{int(q * 100)}Ms': 1000.0 * v for q, v in s.quantiles().items()}}
+                    for stage, s in self._stages.items()}
+
+    def render(self, extra: dict = None) -> str:
+        """
+        Prometheus text exposition. `extra` adds values owned by other
+        components as {name: (type, help, [(labels, value), ...])}.
+        """
+        worker = f'worker="{os.getpid()}"'
+        lines = ['# HELP pramaan_stage_seconds Wall time per pipeline stage (quantiles over the most recent requests).',
+                 '# TYPE pramaan_stage_seconds summary']
+        with self._lock:
+            for stage, s in sorted(self._stages.items()):
+                for q, v in s.quantiles().items():
+                    lines.append(f'pramaan_stage_seconds{{{worker},stage="{stage}",quantile="{q}"}} {v:.6f}')
+                lines.append(f'pramaan_stage_seconds_sum{{{worker},stage="{stage}"}} {s.total:.6f}')
+                lines.append(f'pramaan_stage_seconds_count{{{worker},stage="{stage}"}} {s.count}')
+            for name, counts in sorted(self._counters.items()):
+                lines.append(f'# TYPE {name} counter')
+                for key, value in sorted(counts.items()):
+                    lines.append(f'{name}{{{_labels(worker, key)}}} {value:g}')
+        for name, (kind, help_text, samples) in sorted((extra or {}).items()):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                lines.append(f'{name}{{{_labels(worker, tuple(sorted(labels.items())))}}} {value:g}')
+        return '\n'.join(lines) + '\n'
+
+def _labels(worker: str, key: tuple) -> str:
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in key)
+    return ','.join([worker] + [f'{k}="{v}"' for (k, _), v in zip(key, escaped)])
+
+def format_timing_header(timings: dict) -> str:
+    """X-Pramaan-Timing value in Server-Timing syntax: 'ocr;dur=45.1, ela;dur=12.0'."""
+    return ', '.join(f"{key[:-2] if key.endswith('Ms') else key};dur={ms:.1f}" for key, ms in timings.items())
+
+# -----------------------------------------------------------------------------
+# Sampling Profiler
+# -----------------------------------------------------------------------------
+class SamplingProfiler:
+    """
+    Samples one thread's Python stack every `interval` seconds while active
+    (use as a context manager around the request) and counts collapsed stacks.
+    Sampling happens in a side thread, so the profiled code runs unmodified.
+    """
+
+    def __init__(self, thread_id: int = None, interval: float = 0.005):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._sample, name='pramaan-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+    def collapsed(self) -> str:
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+    def save(self, directory: str, name: str) -> str:
+        """Writes the collapsed stacks to <directory>/<name>.folded and returns the path."""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{name}.folded')
+        with open(path, 'w') as fh:
+            fh.write(self.collapsed())
+        return path
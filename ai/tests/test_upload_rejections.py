@@ -0,0 +1,51 @@
+# Empty and undecodable uploads must get the normal "Invalid image format."
+# rejection, not a 500, on every /ai/check entry point.
+#
+#   cd ai && python -m pytest -q tests
+
+import io
+import json
+import os
+import sys
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('PRAMAAN_MODEL_RELOAD_SECONDS', '0')
+
+import pytest
+import app_rl
+
+INVALID = {'status': 'rejected', 'tamperLikely': True, 'confidence': 1.0, 'reasons': ['Invalid image format.']}
+
+class UnusedModel:
+    """Stands in for a trained model; rejected uploads never reach it."""
+    version = 'test'
+
+    def predict(self, features):
+        raise AssertionError('the model must not be called for an invalid upload')
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app_rl, 'model', UnusedModel())
+    monkeypatch.setattr(app_rl, 'template_index', None)
+    return app_rl.app.test_client()
+
+@pytest.mark.parametrize('body', [b'', b'this is not an image'])
+def test_check_rejects_invalid_upload(client, body):
+    response = client.post('/ai/check', data={'certificate': (io.BytesIO(body), 'upload.png')}, content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert {k: v for k, v in response.get_json().items() if k != 'cached'} == INVALID
+
+def test_batch_rejects_invalid_files_and_zip_members(client):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as z:
+        z.writestr('empty.png', b'')
+        z.writestr('garbage.png', b'this is not an image')
+    archive.seek(0)
+    files = [(io.BytesIO(b''), 'empty.png'), (io.BytesIO(b'not an image either'), 'garbage.png'), (archive, 'docs.zip')]
+    response = client.post('/ai/check/batch', data={'certificates': files}, content_type='multipart/form-data')
+    lines = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert response.status_code == 200
+    assert lines[-1] == {'batchComplete': True, 'total': 4, 'failed': 0}
+    for line in lines[:-1]:
+        assert {k: line[k] for k in INVALID} == INVALID
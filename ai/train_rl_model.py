@@ -4,145 +4,177 @@
 # This version is "PDF-aware." It automatically converts PDFs in the dataset
 # during training, teaching the model to correctly differentiate between a
 # converted-but-legit PDF and a truly tampered image.
+#
+# Model selection: the scaler and classifier form one Pipeline, so each
+# cross-validation fold fits its scaler on its own training split only.
+# Candidate configurations (a fixed grid or random samples) are cross-
+# validated in parallel across cores and ranked by the mean reward of
+# REWARD_TABLE, the asymmetric cost PramaanEnv trains against, where a false
+# positive costs more than a false negative.
 # -----------------------------------------------------------------------------
 
-import cv2
 import numpy as np
 import os
-from PIL import Image
-from sklearn.model_selection import cross_val_score
-from sklearn.ensemble import GradientBoostingClassifier
+from scipy.stats import loguniform, randint, uniform
+from sklearn.ensemble import GradientBoostingClassifier, HistGradientBoostingClassifier
+from sklearn.metrics import make_scorer
+from sklearn.model_selection import GridSearchCV, RandomizedSearchCV, StratifiedKFold
+from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import StandardScaler
 import pickle
-import piexif
-from pdf2image import convert_from_path
+import argparse
+from pramaan_features import feature_signature
+from pramaan_dataset import REAL_PATH, FAKE_PATH, REWARD_TABLE, load_labelled_dataset
+from pramaan_model import COMPILED_MODEL_PATH, export_compiled
+from feedback_log import FEEDBACK_LOG_PATH
 
 # --- Configuration ---
-DATASET_PATH = 'dataset'
-REAL_PATH = os.path.join(DATASET_PATH, 'real')
-FAKE_PATH = os.path.join(DATASET_PATH, 'fake')
 MODEL_SAVE_PATH = 'pramaan_model.pkl'
-# On Windows, you may need to provide the poppler path here for the trainer
-poppler_path_train = r"C:\poppler-25.07.0\Library\bin"
-
-# -----------------------------------------------------------------------------
-# Feature Extraction (13 Features)
-# -----------------------------------------------------------------------------
-def handle_pdf_conversion_train(pdf_path: str) -> str:
-    """Converts a PDF to a temporary PNG for feature extraction during training."""
-    global poppler_path_train
-    try:
-        images = convert_from_path(pdf_path, first_page=1, last_page=1, poppler_path=poppler_path_train if 'poppler_path_train' in globals() else None)
-        if not images: return None
-        image_path = pdf_path + ".tmp.png"
-        images[0].save(image_path, 'PNG')
-        return image_path
-    except Exception as e:
-        print(f"Warning: Could not convert PDF '{os.path.basename(pdf_path)}'. Skipping. Error: {e}")
-        return None
-
-def get_ela_metrics(filepath: str) -> dict:
-    TEMP_ELA_FILE = filepath + '.ela.tmp.jpg'
-    try:
-        original = Image.open(filepath)
-        if original.mode != 'RGB': original = original.convert('RGB')
-        original.save(TEMP_ELA_FILE, 'JPEG', quality=95)
-        original_cv, resaved_cv = cv2.imread(filepath), cv2.imread(TEMP_ELA_FILE)
-        diff = cv2.absdiff(original_cv, resaved_cv)
-        return { 'ela_mean': float(diff.mean()), 'ela_std': float(diff.std()), 'ela_max': float(diff.max()), 'ela_contrast': float(diff.max()) - float(diff.min()) }
-    except Exception:
-        return {'ela_mean': 0.0, 'ela_std': 0.0, 'ela_max': 0.0, 'ela_contrast': 0.0}
-
-def analyze_exif(filepath: str) -> dict:
-    try:
-        exif_dict = piexif.load(filepath)
-        software_tag_present = 1 if piexif.ImageIFD.Software in exif_dict['0th'] else 0
-        has_date_info = 1 if piexif.ImageIFD.DateTime in exif_dict['0th'] else 0
-        return {'software_tag': float(software_tag_present), 'has_date_info': float(has_date_info)}
-    except Exception:
-        return {'software_tag': 1.0, 'has_date_info': 0.0}
-
-def analyze_forensic_metrics(image: np.ndarray) -> dict:
-    b, g, r = cv2.split(image)
-    std_dev_r, std_dev_g, std_dev_b = float(np.std(r)), float(np.std(g)), float(np.std(b))
-    corr_gb = np.corrcoef(g.flatten(), b.flatten())[0, 1]
-    corr_gr = np.corrcoef(g.flatten(), r.flatten())[0, 1]
-    corr_br = np.corrcoef(b.flatten(), r.flatten())[0, 1]
-    avg_corr = (corr_gb + corr_gr + corr_br) / 3.0
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    noise_variance = np.var(gray - cv2.GaussianBlur(gray, (5, 5), 0))
-    laplacian_variance = np.var(cv2.Laplacian(gray, cv2.CV_64F))
-    return { 'laplacian_variance': float(laplacian_variance), 'noise_variance': float(noise_variance), 'cross_channel_correlation': float(avg_corr) if not np.isnan(avg_corr) else 0.0, 'std_dev_r': std_dev_r, 'std_dev_g': std_dev_g, 'std_dev_b': std_dev_b }
-
-def extract_features(filepath: str):
-    try:
-        ela_metrics = get_ela_metrics(filepath)
-        exif_metrics = analyze_exif(filepath)
-        image = cv2.imread(filepath)
-        if image is None: return None
-        other_metrics = analyze_forensic_metrics(image)
-        return [ ela_metrics['ela_mean'], ela_metrics['ela_std'], ela_metrics['ela_max'], ela_metrics['ela_contrast'], other_metrics['laplacian_variance'], other_metrics['noise_variance'], other_metrics['cross_channel_correlation'], other_metrics['std_dev_r'], other_metrics['std_dev_g'], other_metrics['std_dev_b'], exif_metrics['software_tag'], exif_metrics['has_date_info'] ]
-    except Exception:
-        return None
+# The serving copy: flat tree arrays with the scaler folded in (see pramaan_model).
+COMPILED_SAVE_PATH = COMPILED_MODEL_PATH
+CV_FOLDS = 5
+RANDOM_STATE = 42
+
+# --- Search Spaces ---
+# 'default' is the single configuration used when no search is requested;
+# 'grid' is searched exhaustively and 'random' is sampled --n-iter times.
+# Keys are Pipeline parameters, so 'model__' addresses the classifier.
+SEARCH_SPACES = {
+    'gbc': {
+        'default': {'model__n_estimators': [150], 'model__learning_rate': [0.1], 'model__max_depth': [5]},
+        'grid': {
+            'model__n_estimators': [100, 150, 300],
+            'model__learning_rate': [0.05, 0.1],
+            'model__max_depth': [3, 5],
+            'model__subsample': [0.8, 1.0],
+        },
+        'random': {
+            'model__n_estimators': randint(50, 400),
+            'model__learning_rate': loguniform(0.01, 0.3),
+            'model__max_depth': randint(2, 7),
+            'model__subsample': uniform(0.6, 0.4),
+        },
+    },
+    'hgb': {
+        'default': {'model__max_iter': [300], 'model__learning_rate': [0.1], 'model__max_leaf_nodes': [31]},
+        'grid': {
+            'model__max_iter': [200, 500],
+            'model__learning_rate': [0.05, 0.1],
+            'model__max_leaf_nodes': [15, 31],
+            'model__l2_regularization': [0.0, 1.0],
+        },
+        'random': {
+            'model__max_iter': randint(100, 800),
+            'model__learning_rate': loguniform(0.01, 0.3),
+            'model__max_leaf_nodes': randint(7, 63),
+            'model__min_samples_leaf': randint(5, 40),
+            'model__l2_regularization': loguniform(1e-3, 10.0),
+        },
+    },
+}
+
+def expected_reward(y_true, y_pred) -> float:
+    """Mean per-document reward of the predictions under REWARD_TABLE (higher is better)."""
+    return float(REWARD_TABLE[np.asarray(y_true, dtype=int), np.asarray(y_pred, dtype=int)].mean())
+
+def build_classifier(kind: str, early_stopping: bool):
+    """
+    The classifier for `kind`: 'gbc' (GradientBoostingClassifier, the served
+    and compiled model) or 'hgb' (HistGradientBoostingClassifier, much faster
+    to fit). With early stopping, each fit holds out 10% of its training split
+    and stops adding trees once the validation loss stops improving.
+    """
+    if kind == 'hgb':
+        return HistGradientBoostingClassifier(early_stopping=early_stopping, validation_fraction=0.1,
+                                              n_iter_no_change=10, random_state=RANDOM_STATE)
+    return GradientBoostingClassifier(validation_fraction=0.1, n_iter_no_change=10 if early_stopping else None,
+                                      random_state=RANDOM_STATE)
+
+def format_params(params: dict) -> dict:
+    """Classifier parameters without the 'model__' prefix, floats rounded for display."""
+    return {k.replace('model__', ''): (round(float(v), 4) if isinstance(v, (float, np.floating)) else int(v) if isinstance(v, np.integer) else v)
+            for k, v in params.items()}
+
+def print_search_report(search):
+    """One line per configuration: mean reward, accuracy and mean fit time, best first."""
+    results = search.cv_results_
+    print(f"\n{'rank':>4}  {'reward':>15}  {'accuracy':>16}  {'fit s':>7}  params")
+    for i in np.argsort(results['rank_test_reward'], kind='stable'):
+        params = format_params(results['params'][i])
+        print(f"{results['rank_test_reward'][i]:>4}  "
+              f"{results['mean_test_reward'][i]:>7.2f} +/- {results['std_test_reward'][i]:<5.2f}  "
+              f"{results['mean_test_accuracy'][i] * 100:>6.2f}% +/- {results['std_test_accuracy'][i] * 100:>5.2f}%  "
+              f"{results['mean_fit_time'][i]:>7.2f}  {params}")
 
 # -----------------------------------------------------------------------------
 # Main Training Pipeline
 # -----------------------------------------------------------------------------
-def train():
-    features, labels = [], []
-    temp_files_to_clean = []
+def train(workers=None, model_kind='gbc', search='none', n_iter=20, jobs=-1, early_stopping=False, feedback=False):
     print("Starting feature extraction for all files...")
+    # PDFs are rasterized and everything is featurized in a process pool;
+    # files already in the feature cache are not re-extracted, and feedback
+    # rows arrive already featurized.
+    X, y = load_labelled_dataset(workers=workers, feedback_path=FEEDBACK_LOG_PATH if feedback else None)
+    print(f"Processed {len(X)} total files.")
 
-    all_files = [os.path.join(REAL_PATH, f) for f in os.listdir(REAL_PATH)] + \
-                [os.path.join(FAKE_PATH, f) for f in os.listdir(FAKE_PATH)]
-    
-    for filepath in all_files:
-        label = 0 if REAL_PATH in filepath else 1
-        analysis_path = filepath
-        
-        if filepath.lower().endswith('.pdf'):
-            analysis_path = handle_pdf_conversion_train(filepath)
-            if analysis_path:
-                temp_files_to_clean.append(analysis_path)
-
-        if analysis_path:
-            vec = extract_features(analysis_path)
-            if vec:
-                features.append(vec)
-                labels.append(label)
-
-    print(f"Processed {len(features)} total files.")
-    
-    # Clean up temporary PNGs from PDF conversion
-    for f in temp_files_to_clean: os.remove(f)
-
-    if len(features) < 20:
+    if len(X) < 20:
         print("\nFATAL: Dataset is too small. Please add at least 10 diverse files per class.")
         return
 
-    X, y = np.array(features), np.array(labels)
-    scaler = StandardScaler().fit(X)
-    X_scaled = scaler.transform(X)
-    
-    print("\nTraining and evaluating the Gradient Boosting model with Cross-Validation...")
-    model = GradientBoostingClassifier(n_estimators=150, learning_rate=0.1, max_depth=5, random_state=42)
-    scores = cross_val_score(model, X_scaled, y, cv=5, scoring='accuracy')
-    
-    print(f"\nCross-Validation Scores (5 tests): {scores}")
-    print(f"Average Accuracy: {scores.mean() * 100:.2f}% (+/- {scores.std() * 2 * 100:.2f}%)")
-
-    print("\nTraining the final model on the entire dataset...")
-    model.fit(X_scaled, y)
-    
-    saved_model = {'model': model, 'scaler': scaler}
-    with open(MODEL_SAVE_PATH, 'wb') as f:
+    pipeline = Pipeline([('scaler', StandardScaler()), ('model', build_classifier(model_kind, early_stopping))])
+    space = SEARCH_SPACES[model_kind]['grid' if search == 'grid' else 'random' if search == 'random' else 'default']
+    options = dict(scoring={'reward': make_scorer(expected_reward), 'accuracy': 'accuracy'}, refit='reward',
+                   cv=StratifiedKFold(n_splits=CV_FOLDS, shuffle=True, random_state=RANDOM_STATE), n_jobs=jobs)
+    if search == 'random':
+        searcher = RandomizedSearchCV(pipeline, space, n_iter=n_iter, random_state=RANDOM_STATE, **options)
+    else:
+        searcher = GridSearchCV(pipeline, space, **options)
+
+    print(f"\nCross-validating {model_kind} ({search} search, {CV_FOLDS} folds, n_jobs={jobs})...")
+    # refit='reward' retrains the best configuration on the entire dataset.
+    searcher.fit(X, y)
+    print_search_report(searcher)
+
+    best = searcher.best_index_
+    results = searcher.cv_results_
+    print(f"\nSelected by mean reward: {format_params(searcher.best_params_)}")
+    print(f"Reward per document: {results['mean_test_reward'][best]:.2f} "
+          f"(+/- {results['std_test_reward'][best] * 2:.2f}); "
+          f"Average Accuracy: {results['mean_test_accuracy'][best] * 100:.2f}% "
+          f"(+/- {results['std_test_accuracy'][best] * 2 * 100:.2f}%)")
+    print(f"Final model refit on the entire dataset in {searcher.refit_time_:.2f}s.")
+
+    model = searcher.best_estimator_.named_steps['model']
+    scaler = searcher.best_estimator_.named_steps['scaler']
+    saved_model = {'model': model, 'scaler': scaler, **feature_signature()}
+    # Written to a temporary file and renamed, so a running API that reloads
+    # the model never reads a half-written pickle.
+    tmp_path = MODEL_SAVE_PATH + '.tmp'
+    with open(tmp_path, 'wb') as f:
         pickle.dump(saved_model, f)
+    os.replace(tmp_path, MODEL_SAVE_PATH)
     print(f"Final model and scaler saved successfully to {MODEL_SAVE_PATH}")
+    if isinstance(model, GradientBoostingClassifier):
+        export_compiled(model, scaler, COMPILED_SAVE_PATH, saved_model)
+        print(f"Compiled model exported to {COMPILED_SAVE_PATH}")
+    elif os.path.exists(COMPILED_SAVE_PATH):
+        # Only GradientBoostingClassifier compiles; a stale .npz would shadow the new pickle.
+        os.remove(COMPILED_SAVE_PATH)
+        print(f"Removed stale {COMPILED_SAVE_PATH}; the API will serve the pickle.")
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Train the Pramaan forensic model.")
+    parser.add_argument('--workers', type=int, default=None, help="Feature extraction processes (default: PRAMAAN_FEATURE_WORKERS or all cores).")
+    parser.add_argument('--model', choices=sorted(SEARCH_SPACES), default='gbc', help="gbc: GradientBoosting (compiled for serving); hgb: HistGradientBoosting (faster to fit, served from the pickle).")
+    parser.add_argument('--search', choices=['none', 'grid', 'random'], default='none', help="Hyperparameter search (default: the single default configuration).")
+    parser.add_argument('--n-iter', type=int, default=20, help="Configurations sampled by --search random.")
+    parser.add_argument('--jobs', type=int, default=-1, help="Parallel cross-validation fits (default: all cores).")
+    parser.add_argument('--feedback', action='store_true', help=f"Also train on the adjudicated verdicts in {FEEDBACK_LOG_PATH}.")
+    parser.add_argument('--early-stopping', action='store_true', help="Stop adding trees once a 10%% validation split stops improving.")
+    args = parser.parse_args()
     if not os.path.exists(REAL_PATH) or not os.path.exists(FAKE_PATH):
         os.makedirs(REAL_PATH, exist_ok=True); os.makedirs(FAKE_PATH, exist_ok=True)
         print("Created 'dataset' folders. Please add files and run again.")
     else:
-        train()
-
+        train(workers=args.workers, model_kind=args.model, search=args.search, n_iter=args.n_iter,
+              jobs=args.jobs, early_stopping=args.early_stopping, feedback=args.feedback)
@@ -0,0 +1,100 @@
+# -----------------------------------------------------------------------------
+# Pramaan Verdict Cache
+#
+# Remembers the /ai/check response for each (content hash, model version), so
+# a re-submitted certificate is answered without OCR, PDF rasterization or
+# feature extraction. Entries live in a bounded in-memory LRU with a TTL and,
+# optionally, in a local SQLite file that survives restarts and is shared by
+# every worker process on the box.
+# -----------------------------------------------------------------------------
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+class VerdictCache:
+    """Bounded LRU + TTL cache of verdicts keyed by (sha256, model_version)."""
+
+    # Expired SQLite rows are purged once every this many writes.
+    PURGE_EVERY = 256
+
+    def __init__(self, max_entries: int = 4096, ttl_seconds: float = 86400.0, db_path: str = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = self.misses = 0
+        self._db = None
+        self._db_pid = None
+
+    def _connection(self):
+        """
+        The SQLite connection of this process, opened on first use. A SQLite
+        connection must not cross a fork, so pre-forked workers each open their own.
+        """
+        if self.db_path and self._db_pid != os.getpid():
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS verdicts (sha256 TEXT, model_version TEXT, created REAL, verdict TEXT, PRIMARY KEY (sha256, model_version))")
+            self._db_pid = os.getpid()
+        return self._db
+
+    def get(self, sha256: str, model_version: str):
+        """Returns the cached verdict dict, or None on a miss or an expired entry."""
+        key = (sha256, model_version)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry[0] <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self._entries[key]
+            db = self._connection()
+            if db is not None:
+                row = db.execute("SELECT created, verdict FROM verdicts WHERE sha256 = ? AND model_version = ?", key).fetchone()
+                if row and now - row[0] <= self.ttl_seconds:
+                    verdict = json.loads(row[1])
+                    self._remember(key, row[0], verdict)
+                    self.hits += 1
+                    return verdict
+            self.misses += 1
+            return None
+
+    def put(self, sha256: str, model_version: str, verdict: dict):
+        """Stores a verdict; it must be JSON-serializable."""
+        key = (sha256, model_version)
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, verdict)
+            db = self._connection()
+            if db is not None:
+                db.execute("INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?)", (*key, now, json.dumps(verdict)))
+                self._writes += 1
+                if self._writes % self.PURGE_EVERY == 0:
+                    db.execute("DELETE FROM verdicts WHERE created < ?", (now - self.ttl_seconds,))
+
+    def _remember(self, key, created: float, verdict: dict):
+        self._entries[key] = (created, verdict)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'maxEntries': self.max_entries,
+                'ttlSeconds': self.ttl_seconds,
+                'persistent': bool(self.db_path),
+            }